@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the gp and gp_local filters.
+
+Filters a noisy synthetic MLR signal of increasing length with the exact
+Gaussian process filter (gp) and the blocked version (gp_local) and reports
+the time and the RMS error with respect to the noise free signal. The column
+"diff" is the RMS difference between the two filtered signals.
+
+Usage:
+    python benchmarks/bench_gp_filter.py [--rows 500 1000 2000]
+                                         [--no-exact] [--seed 0]
+"""
+import time
+import argparse
+import numpy as np
+from pyropython.filter import gp_filter, local_gp_filter
+
+
+def signal(n):
+    Time = np.linspace(0, 3600, num=n)
+    y = 50 - 50*np.tanh((Time - 1200)/200) + 5*np.sin(Time/80)
+    return Time, y
+
+
+def rms(a, b):
+    return np.sqrt(np.mean((a - b)**2))
+
+
+def timed(filt, x, y):
+    start = time.perf_counter()
+    ybar = filt(x, y)
+    return ybar, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+",
+                        default=[500, 1000, 2000])
+    parser.add_argument("--no-exact", action="store_true",
+                        help="only run gp_local")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.RandomState(args.seed)
+    print("%8s %12s %10s %12s %10s %10s" % ("rows", "gp time", "gp rms",
+                                            "local time", "local rms",
+                                            "diff"))
+    for n in args.rows:
+        x, y = signal(n)
+        ny = y + 5*rng.randn(n)
+        local, t_local = timed(local_gp_filter, x, ny)
+        if args.no_exact:
+            print("%8d %12s %10s %10.2f s %10.3f %10s" %
+                  (n, "-", "-", t_local, rms(local, y), "-"))
+            continue
+        exact, t_exact = timed(gp_filter, x, ny)
+        print("%8d %10.2f s %10.3f %10.2f s %10.3f %10.3f" %
+              (n, t_exact, rms(exact, y), t_local, rms(local, y),
+               rms(exact, local)))
+
+
+if __name__ == "__main__":
+    main()
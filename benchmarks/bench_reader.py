@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the csv readers used for the simulation output.
+
+Writes FDS style devc files of increasing length and times reading two
+columns from them with:
+
+    pandas-full   the reader used before read_fds_csv(): pandas.read_csv of
+                  the whole file, units stripped from all headers and
+                  dropna() over all columns
+    pandas        utils._read_columns_pandas(), pandas with usecols
+    fds_csv       utils.read_fds_csv()
+
+Usage:
+    python benchmarks/bench_reader.py [--rows 10000 100000 1000000]
+                                      [--cols 20] [--repeat 3]
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from pyropython.utils import read_fds_csv, _read_columns_pandas
+
+
+def pandas_full(fname, columns, header=1):
+    from pandas import read_csv
+    tmp = read_csv(fname,
+                   header=header,
+                   encoding="latin-1",
+                   index_col=False,
+                   comment="#",
+                   on_bad_lines="warn",
+                   skip_blank_lines=True,
+                   na_values="NaN")
+    tmp.columns = [colname.split('(')[0].strip() for colname in tmp.columns]
+    tmp = tmp.dropna(axis=1, how='any')
+    return {name: np.array(tmp[name]) for name in columns}
+
+
+readers = {"pandas-full": pandas_full,
+           "pandas": _read_columns_pandas,
+           "fds_csv": read_fds_csv}
+
+
+def write_devc(fname, rows, cols):
+    names = ['"Time"'] + ['"TC%02d"' % n for n in range(1, cols)]
+    units = ['"s"'] + ['"C"']*(cols - 1)
+    data = np.random.rand(rows, cols)
+    data[:, 0] = np.arange(rows)*0.1
+    with open(fname, "w") as f:
+        f.write(",".join(units) + "\n")
+        f.write(",".join(names) + "\n")
+        np.savetxt(f, data, delimiter=",", fmt="%15.7E")
+
+
+def best_time(reader, fname, columns, repeat):
+    times = []
+    for n in range(repeat):
+        start = time.perf_counter()
+        reader(fname, columns=columns)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+",
+                        default=[10**4, 10**5, 10**6])
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    columns = ["Time", "TC%02d" % (args.cols // 2)]
+    print("%10s" % "rows" + "".join("%14s" % name for name in readers))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in args.rows:
+            fname = os.path.join(tmpdir, "bench_devc.csv")
+            write_devc(fname, rows, args.cols)
+            times = [best_time(reader, fname, columns, args.repeat)
+                     for reader in readers.values()]
+            print("%10d" % rows + "".join("%12.4f s" % t for t in times))
+
+
+if __name__ == "__main__":
+    main()
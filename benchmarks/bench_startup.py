@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the start up time of the command line tools and worker
+processes.
+
+Each module is imported in a fresh python interpreter and the best wall
+time of several runs is reported, together with the time of starting the
+interpreter alone. With --importtime, the slowest imports of each module
+are listed using "python -X importtime".
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--importtime]
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+modules = ["pyropython.pyropython",  # pyropython command
+           "pyropython.plotting",    # plot_pyro command
+           "pyropython.model",       # imported by spawned worker processes
+           "pyropython.workers"]
+
+
+def best_time(code, repeat):
+    times = []
+    for n in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def slowest_imports(module, num=5):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           "import " + module],
+                          check=True, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    rows = []
+    for line in proc.stderr.splitlines()[1:]:
+        fields = line.split("|")
+        if len(fields) == 3:
+            rows.append((int(fields[1]), fields[2].strip()))
+    rows.sort(reverse=True)
+    return rows[1:num + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true",
+                        help="list the slowest imports of each module")
+    args = parser.parse_args()
+    base = best_time("pass", args.repeat)
+    print("%-25s %10.3f s" % ("python", base))
+    for module in modules:
+        t = best_time("import " + module, args.repeat)
+        print("%-25s %10.3f s" % (module, t))
+        if args.importtime:
+            for usec, name in slowest_imports(module):
+                print("    %-21s %10.3f s" % (name, usec*1e-6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.archive: Compact archive of all evaluated models
+
+The archive stores, for every evaluation, the parameter vector, the objective
+value and the (T, F) columns read from the simulation output. The working
+directories themselves are not kept. Evaluations are buffered in memory and
+written in chunks, when a chunk is full or the buffer has been kept for
+flush_interval seconds, each chunk a directory of .npy files:
+
+    archive_dir/
+        chunk_000000/
+            meta.json       variable names and parameter names
+            x.npy           parameter vectors, shape (n, ndim)
+            f.npy           objective values, shape (n,)
+            T_0.npy         T columns of the first variable, concatenated
+            F_0.npy         F columns of the first variable, concatenated
+            offsets_0.npy   start of each evaluation in T_0 and F_0, (n+1,)
+            ...
+        chunk_000001/
+        ...
+
+Chunks are never modified after they have been written, and the arrays are
+read lazily using memory mapping.
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+
+class ArchiveChunk:
+    """ Read access to one chunk of an Archive """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.keys = meta["keys"]
+        self.params = meta["params"]
+        self.x = self._load("x")
+        self.f = self._load("f")
+        self._columns = {}
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.f)
+
+    def columns(self, key):
+        """ Returns the concatenated columns of variable key
+
+        Returns:
+            T, F (:array): concatenated columns of all evaluations
+            offsets (:array): the columns of evaluation n are
+                T[offsets[n]:offsets[n+1]] and F[offsets[n]:offsets[n+1]]
+        """
+        if key not in self._columns:
+            n = self.keys.index(key)
+            self._columns[key] = (self._load("T_%d" % n),
+                                  self._load("F_%d" % n),
+                                  self._load("offsets_%d" % n))
+        return self._columns[key]
+
+    def data(self, n):
+        """ Returns the simulation data of evaluation n
+
+        Returns:
+            data (:dict): Dictionary, with entries key: (T,F)
+        """
+        data = {}
+        for key in self.keys:
+            T, F, offsets = self.columns(key)
+            start, end = offsets[n], offsets[n+1]
+            data[key] = T[start:end], F[start:end]
+        return data
+
+
+class Archive:
+    """ Append-only archive of evaluations
+
+    Args:
+        archive_dir (:string): Directory of the archive. Existing chunks are
+            kept and new chunks are added after them.
+        params (:list): Parameter names and bounds, as in Model.params
+        chunk_size (:int): Number of evaluations per chunk
+        dtype (:string): Data type for the simulation data columns
+        flush_interval (:float): Maximum time in seconds that evaluations
+            are kept in memory, see flush_due(). If None, only full chunks
+            are written before flush().
+    """
+
+    def __init__(self, archive_dir, params=None, chunk_size=1000,
+                 dtype="float32", flush_interval=60.0):
+        self.archive_dir = archive_dir
+        self.params = params
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.flush_interval = flush_interval
+        self._buffer = []
+        # time.monotonic() of the oldest buffered evaluation
+        self._buffer_time = None
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def _chunk_dirs(self):
+        return sorted(os.path.join(self.archive_dir, name)
+                      for name in os.listdir(self.archive_dir)
+                      if name.startswith("chunk_") and
+                      not name.endswith(".tmp"))
+
+    def append(self, fi, xi, data):
+        """ Add an evaluation to the archive
+
+        Args:
+            fi (:float): objective value
+            xi (list like): parameter vector
+            data (:dict): Dictionary, with entries key: (T,F)
+        """
+        if not self._buffer:
+            self._buffer_time = time.monotonic()
+        self._buffer.append((fi, xi, data))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        else:
+            self.flush_due()
+
+    def flush_due(self):
+        """ Write the buffered evaluations if the oldest one has been kept
+            for flush_interval seconds, so that a killed run loses at most
+            that much.
+        """
+        if (self._buffer and self.flush_interval is not None and
+                time.monotonic() - self._buffer_time >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered evaluations to a new chunk """
+        if not self._buffer:
+            return
+        keys = sorted(self._buffer[0][2])
+        # group the evaluations by variable names, which should
+        # normally be the same for all
+        rest = [item for item in self._buffer if sorted(item[2]) != keys]
+        items = [item for item in self._buffer if sorted(item[2]) == keys]
+        num = len(self._chunk_dirs())
+        name = os.path.join(self.archive_dir, "chunk_%06d" % num)
+        tmpname = name + ".tmp"
+        # remove leftovers of an interrupted flush
+        shutil.rmtree(tmpname, ignore_errors=True)
+        os.makedirs(tmpname)
+        meta = {"keys": keys,
+                "params": [pname for pname, bounds in self.params or []]}
+        with open(os.path.join(tmpname, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        np.save(os.path.join(tmpname, "x.npy"),
+                np.array([xi for fi, xi, data in items], dtype=float))
+        np.save(os.path.join(tmpname, "f.npy"),
+                np.array([fi for fi, xi, data in items], dtype=float))
+        for n, key in enumerate(keys):
+            T = [np.asarray(data[key][0]) for fi, xi, data in items]
+            F = [np.asarray(data[key][1]) for fi, xi, data in items]
+            offsets = np.zeros(len(items) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(t) for t in T])
+            np.save(os.path.join(tmpname, "T_%d.npy" % n),
+                    np.concatenate(T).astype(self.dtype))
+            np.save(os.path.join(tmpname, "F_%d.npy" % n),
+                    np.concatenate(F).astype(self.dtype))
+            np.save(os.path.join(tmpname, "offsets_%d.npy" % n), offsets)
+        os.rename(tmpname, name)
+        self._buffer = []
+        if rest:
+            self._buffer = rest
+            self.flush()
+
+    def chunks(self):
+        """ Returns the chunks written so far as a list of ArchiveChunks """
+        return [ArchiveChunk(path) for path in self._chunk_dirs()]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks()) + len(self._buffer)
+
+    def __iter__(self):
+        """ Iterates over all written evaluations, yielding (fi, xi, data) """
+        for chunk in self.chunks():
+            for n in range(len(chunk)):
+                yield chunk.f[n], chunk.x[n], chunk.data(n)
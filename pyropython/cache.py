@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.cache: On-disk caches used to avoid repeating expensive work
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+
+
+class ResultCache:
+    """ Content-addressed cache of simulation results
+
+    The results (the (T, F) columns read from the simulation output) are
+    stored in .npz files named by a hash of the rendered input files, the
+    simulator command and the data line definitions. If a parameter vector
+    produces input files identical to an earlier run, the stored columns are
+    returned and the simulator is not launched.
+
+    The cache is safe to share between processes: entries are written to a
+    temporary file and moved in place atomically.
+    """
+
+    def __init__(self,
+                 cache_dir="Cache/",
+                 max_size=None,
+                 max_age=None,
+                 evict_interval=100):
+        """ Initialize cache
+
+        Args:
+            cache_dir (:string): Directory for the cache entries.
+            max_size (:float, optional): Maximum size of the cache in MB.
+                Least recently used entries are removed first.
+            max_age (:float, optional): Entries older than max_age days are
+                removed.
+            evict_interval (:int): Check the size and age limits after this
+                many new entries.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._num_puts = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, inputs, command, simulation):
+        """ Compute the cache key
+
+        Args:
+            inputs (:dict): Rendered input files in format {fname: text},
+                or {fname: digest} with digests of the rendered files
+            command (:string): Simulator command
+            simulation (:dict): Data line definitions (see Model.simulation)
+
+        Returns:
+            key (:string): hex digest
+        """
+        h = hashlib.sha256()
+        h.update(command.encode())
+        for fname in sorted(inputs):
+            h.update(b"\0" + fname.encode() + b"\0")
+            h.update(inputs[fname].encode())
+        h.update(json.dumps(simulation, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def get(self, key):
+        """ Return cached data for key or None if not found.
+
+        Returns:
+            data (:dict): Dictionary, with entries key: (T,F)
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as tmp:
+                data = {name: (tmp["T_" + name], tmp["F_" + name])
+                        for name in tmp["keys"]}
+        except (OSError, KeyError, ValueError):
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """ Store data under key
+
+        Args:
+            key (:string): key from ResultCache.key()
+            data (:dict): Dictionary, with entries key: (T,F)
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {"keys": np.array(list(data))}
+        for name, (T, F) in data.items():
+            arrays["T_" + name] = T
+            arrays["F_" + name] = F
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmpname, path)
+        self._num_puts += 1
+        if self._num_puts % self.evict_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """ Remove entries older than max_age and, if the cache is larger
+            than max_size, the least recently used entries.
+
+        Returns:
+            removed (:int): number of removed entries
+        """
+        if self.max_size is None and self.max_age is None:
+            return 0
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        removed = 0
+        total = sum(size for mtime, size, path in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            too_old = (self.max_age is not None and
+                       now - mtime > self.max_age*86400.0)
+            too_big = (self.max_size is not None and
+                       total > self.max_size*1e6)
+            if not (too_old or too_big):
+                # entries are sorted by age, nothing more to remove
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return removed
+
+
+# modules whose code determines the processed data, see processing_digest()
+PROCESSING_MODULES = ["pyropython.utils", "pyropython.filter"]
+_processing_digest = None
+
+
+def processing_digest():
+    """ Hash of the source files of PROCESSING_MODULES, computed once """
+    global _processing_digest
+    if _processing_digest is None:
+        import importlib
+        h = hashlib.sha256()
+        for name in PROCESSING_MODULES:
+            with open(importlib.import_module(name).__file__, "rb") as f:
+                h.update(f.read())
+        _processing_digest = h.hexdigest()
+    return _processing_digest
+
+
+class DataCache:
+    """ Content-addressed cache of processed data series
+
+    Reading and filtering the experimental data can be slow, e.g. with the
+    gp filter. The processed series (T, F) returned by utils.read_data()
+    are stored in .npz files named by a hash of the data file contents, the
+    data line options (columns, filter, normalization, etc.) and the source
+    code of the modules processing the data, so that changes to the
+    processing invalidate the old entries.
+    """
+
+    def __init__(self, cache_dir="DataCache/"):
+        """ Initialize cache
+
+        Args:
+            cache_dir (:string): Directory for the cache entries.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, fname, cwd="./", **options):
+        """ Compute the cache key for a data line
+
+        Args:
+            fname (:string): Data file name
+            cwd (:string): Directory of the data file
+            options: The other arguments of utils.read_data()
+
+        Returns:
+            key (:string): hex digest
+        """
+        h = hashlib.sha256()
+        with open(os.path.join(cwd, fname), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        h.update(json.dumps(options, sort_keys=True, default=str).encode())
+        h.update(processing_digest().encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def read_data(self, **line):
+        """ Same as utils.read_data(), but returns the cached result if the
+            file and options have not changed.
+        """
+        from pyropython.utils import read_data
+        key = self.key(**line)
+        path = self._path(key)
+        try:
+            with np.load(path) as tmp:
+                return tmp["T"], tmp["F"]
+        except (OSError, KeyError, ValueError):
+            pass
+        T, F = read_data(**line)
+        fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, T=T, F=F)
+        os.replace(tmpname, path)
+        return T, F
@@ -11,7 +11,10 @@ from numpy import float64, interp, ones
 import warnings
 from collections import namedtuple
 from pyropython.utils import read_data
-from pyropython.objective_functions import get_objective_function
+from pyropython.objective_functions import get_objective_function,\
+    nonnegative_objectives
+from pyropython.reduction import get_reduction
+from pyropython.scheduler import CoreSlots, Resources
 
 
 case = None
@@ -66,42 +69,17 @@ def _check_misspellings(dict, valid_keys):
             msg = "Unknown keyword {key:s} did you mean {q:s}?"
             warnings.warn(msg.format(key=key, q=quess))
 
-def _proc_optimizer_opts(args_dict):
-    """Process optimizer kwargs. 
-    
-    This is meainly used to set different defaults
-    for skopt.learn - Tree regressors. 
-    """
-    from skopt.utils import cook_estimator
-    if args_dict is None:
-        return {}
-    if "base_estimator" in args_dict:
-        if args_dict["base_estimator"]=="ET":
-            args = {"n_estimators": 100,
-                    "min_samples_leaf":3,
-                    "max_depth":None,
-                    "bootstrap":False}
-        elif args_dict["base_estimator"]=="ET2":
-            args = {"n_estimators": 1000,
-                    "min_samples_leaf":1,
-                    "max_depth":None,
-                    "bootstrap":False}
-            args_dict["base_estimator"]="ET"
-        elif args_dict["base_estimator"]=="RF":
-            args = {"n_estimators": 100,
-                    "min_samples_leaf": 1,
-                    "max_depth": None,
-                    "bootstrap": True}
-        elif args_dict["base_estimator"]=="GBRT":
-            args = None
-        else:
-            args = None
-        if args: 
-            args_dict["base_estimator"] = cook_estimator(
-                                            args_dict["base_estimator"],
-                                            **args)
-    return args_dict
-        
+def _data_reader(cfg):
+    """
+    Returns the function used for reading experimental data. The processed
+    data is cached in data_cache_dir, if it is given.
+    """
+    cache_dir = cfg.get("data_cache_dir", None)
+    if cache_dir is None:
+        return read_data
+    from pyropython.cache import DataCache
+    return DataCache(cache_dir).read_data
+
 
 def _set_data_line_defaults(line,
                             ind_col_name="Time",
@@ -163,16 +141,23 @@ def _check_templates(templates,params):
         sys.exit('Problems with templates. Exiting.')
     pass
 
+def load_config(input):
+    """
+    Returns the configuration as a dictionary. The input is either the name
+    of a yaml file or an already loaded dictionary, which is returned as is.
+    """
+    if isinstance(input, dict):
+        return input
+    with open(input, "r") as f:
+        return y.safe_load(f)
+
+
 def read_model(input):
     """
     This function creates a initialized Model object based on the dictionary
     "cfg". The dictionary is assumed to be produced by reading a yaml file.
     """
-    if isinstance(input, str):
-        lines = open(input, "r").read()
-        cfg = y.load(lines)
-    elif isinstance(input, dict):
-        cfg = input
+    cfg = load_config(input)
     """
     Check for required fields
     """
@@ -224,15 +209,21 @@ def read_model(input):
     for key, line in simulation.items():
         line = _set_data_line_defaults(line)
 
+    read_exp_data = _data_reader(cfg)
     exp_data = {}
+    reductions = {}
     for key, line in experiment.items():
         """
         For experimental data we expect only one header line unless indicates
         otherwise
         """
+        reductions[key] = line.get("reduction", None)
+        # the parsed config may be shared, e.g. with read_plots()
+        line = dict(line)
+        line.pop("reduction", None)
         line = _set_data_line_defaults(line,
                                        header=0)
-        exp_data[key] = read_data(**line)
+        exp_data[key] = read_exp_data(**line)
 
     """
     Read and process the "objective" dictionary
@@ -271,7 +262,7 @@ def read_model(input):
         if key in data_weights:
             entry = data_weights[key]
             if isinstance(entry, dict):
-                wtime, weights = read_data(**entry)
+                wtime, weights = read_exp_data(**entry)
             elif isinstance(entry, list):
                 wtime, weights = zip(*entry)
             else:
@@ -285,6 +276,21 @@ def read_model(input):
         weightsi = interp(etime, wtime, weights)
         data_weights[key] = weightsi
 
+    """
+    Optional reduction of the experimental data to fewer points. Format:
+    reduction: {type: bin, num_points: 200}
+    The data weights are reduced together with the data.
+    """
+    for key, opts in reductions.items():
+        if not opts:
+            continue
+        opts = dict(opts)
+        reduce = get_reduction(opts.pop("type", "bin"))
+        etime, edata = exp_data[key]
+        etime, edata, data_weights[key] = reduce(etime, edata,
+                                                 data_weights[key], **opts)
+        exp_data[key] = etime, edata
+
     if "fds_command" not in cfg:
         warnings.warn("fds_command not defined. Using 'fds'")
     fds_command = cfg.get("fds_command", "fds")
@@ -296,6 +302,75 @@ def read_model(input):
     # Check ih the temnplates can be rendered
     _check_templates(templates, variables)
     tempdir = os.path.join(os.getcwd(), "Work/")
+
+    """
+    Optional cache of simulation results. Format:
+    cache: {cache_dir: "Cache/", max_size: 1000, max_age: 30}
+    where max_size is in MB and max_age in days.
+    """
+    jobs_per_eval = cfg.get("jobs_per_eval", 1)
+    """
+    Optional resources of the simulations and sharing of the cores between
+    the concurrent simulations. Format:
+    num_cores: 16
+    pin_cores: true
+    launch_command: "mpiexec -n {ranks} {command} {fname}"
+    resources:
+        template1.fds: {ranks: 4, threads: 1}
+    """
+    resources = {}
+    for fname, opts in (cfg.get("resources", None) or {}).items():
+        if fname not in templates:
+            raise ValueError("Resources given for %s, which is not a template"
+                             % fname)
+        resources[fname] = Resources(**(opts or {}))
+    slots = None
+    pin_cores = cfg.get("pin_cores", False)
+    if "num_cores" in cfg or resources or pin_cores:
+        slots = CoreSlots(cfg.get("num_cores", None), pin=pin_cores)
+    """
+    Optional early termination of hopeless simulations. Format:
+    early_termination: {factor: 2.0, interval: 10.0}
+    """
+    early_termination = None
+    if "early_termination" in cfg:
+        early_termination = cfg["early_termination"] or {}
+        if objective_function not in nonnegative_objectives:
+            warnings.warn("Early termination is not supported for objective "
+                          "function %s. Disabled." % objective_name)
+            early_termination = None
+    """
+    Optional wall time limits of the simulations. Format:
+    timeout: {max_time: 7200, factor: 5.0, min_samples: 5, penalty: 100.0,
+              retries: 1, retry_timeouts: False}
+    """
+    timeout = cfg.get("timeout", None) or None
+    """
+    Optional archive of all evaluations, see pyropython.archive. The
+    simulation data is only returned by the workers if it is needed.
+    """
+    keep_data = cfg.get("archive_dir", None) is not None
+    """
+    Optional location of the working directories, e.g. on a RAM-backed file
+    system, and input files linked into every working directory. Format:
+    sandbox_dir: /dev/shm/pyropython/
+    static_files: [mesh.bin, restart.dat]
+    """
+    sandbox_dir = cfg.get("sandbox_dir", None)
+    static_files = [os.path.abspath(fname)
+                    for fname in cfg.get("static_files", None) or []]
+    for fname in static_files:
+        if not os.path.isfile(fname):
+            raise ValueError("Static file %s not found" % fname)
+    cache = None
+    if "cache" in cfg:
+        from pyropython.cache import ResultCache
+        cache_opts = cfg["cache"] or {}
+        cache = ResultCache(**cache_opts)
+    # name the incumbent and runtime files like the log file
+    casename = cfg.get("casename", None)
+    if not casename and "logfilename" in cfg:
+        casename = os.path.splitext(os.path.basename(cfg["logfilename"]))[0]
     from pyropython.model import Model
     return Model(exp_data=exp_data,
                  params=variables,
@@ -306,18 +381,25 @@ def read_model(input):
                  command=fds_command,
                  objective_function=objective_function,
                  tempdir=tempdir,
-                 objective_opts=objective_opts)
+                 objective_opts=objective_opts,
+                 cache=cache,
+                 jobs_per_eval=jobs_per_eval,
+                 early_termination=early_termination,
+                 keep_data=keep_data,
+                 sandbox_dir=sandbox_dir,
+                 static_files=static_files,
+                 resources=resources,
+                 launch_command=cfg.get("launch_command", None),
+                 slots=slots,
+                 timeout=timeout,
+                 casename=casename)
 
 
 def read_plots(input):
     """
     This function reads a config file and gathers all data needed for 'plots'
     """
-    if isinstance(input, str):
-        lines = open(input, "r").read()
-        cfg = y.load(lines)
-    elif isinstance(input, dict):
-        cfg = input
+    cfg = load_config(input)
 
     plot_data = namedtuple('plot_data',
                            ['raw_data',
@@ -337,29 +419,29 @@ def read_plots(input):
     plot_data.plots = cfg.get('plots', {})
     plot_data.exp_data = {}
     plot_data.raw_data = {}
+    read_exp_data = _data_reader(cfg)
     for key, line in experiment.items():
         """
         For experimental data we expect only one header line unless indicates
         otherwise
         """
+        # plots show the data before reduction
+        line = dict(line)
+        line.pop("reduction", None)
         line = _set_data_line_defaults(line,
                                        header=0)
-        plot_data.exp_data[key] = read_data(**line)
+        plot_data.exp_data[key] = read_exp_data(**line)
         tmp = dict(line)  # create copy
         tmp["filter_type"] = "None"
-        plot_data.raw_data[key] = read_data(**tmp)
-    run_opts = proc_general_options(input)
+        plot_data.raw_data[key] = read_exp_data(**tmp)
+    run_opts = proc_general_options(cfg)
     plot_data.fig_dir = run_opts.fig_dir
     plot_data.output_dir = run_opts.output_dir
     return plot_data
 
 
 def proc_general_options(input):
-    if isinstance(input, str):
-        lines = open(input, "r").read()
-        cfg = y.load(lines)
-    elif isinstance(input, dict):
-        cfg = input
+    cfg = load_config(input)
     run_opts = namedtuple('run_opts',
                           ['num_jobs', 'max_iter', 'num_points',
                            'num_initial', 'initial_design',
@@ -371,8 +453,14 @@ def proc_general_options(input):
     run_opts.num_points = cfg.get("num_points", 1)
     run_opts.num_initial = cfg.get("num_initial", 1)
     run_opts.initial_design = cfg.get("initial_design", "rand")
+    run_opts.asynchronous = cfg.get("asynchronous", False)
+    run_opts.archive_dir = cfg.get("archive_dir", None)
+    run_opts.archive_flush_interval = cfg.get("archive_flush_interval", 60.0)
+    run_opts.executor = cfg.get("executor", "process")
+    run_opts.executor_opts = cfg.get("executor_opts", None) or {}
     opt = cfg.get("optimizer", {})
-    run_opts.optimizer_opts = _proc_optimizer_opts(opt) 
+    # processed by the optimizer, see optimizer._proc_optimizer_opts
+    run_opts.optimizer_opts = opt or {}
     run_opts.optimizer_name = cfg.get("optimizer_name", "skopt")
     run_opts.output_dir = cfg.get("output_dir", "Best/")
     run_opts.fig_dir = cfg.get("fig_dir", "Figs/")
@@ -396,9 +484,11 @@ def read_config(fname):
     """
     Reads and processes pyropython config file
     """
-    case = read_model(fname)
+    # parse the file only once
+    cfg = load_config(fname)
+    case = read_model(cfg)
     # check for misspelled keys
-    run_opts = proc_general_options(fname)
+    run_opts = proc_general_options(cfg)
     return case, run_opts
 
 
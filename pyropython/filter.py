@@ -5,11 +5,7 @@
 pyropython.filter: Data filtering functions for smoothing experimental data
 """
 
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import Matern, WhiteKernel,\
-    ConstantKernel
 import numpy as np
-import scipy.signal as signal
 
 
 def gp_filter(x, y,
@@ -27,6 +23,9 @@ def gp_filter(x, y,
                  parameters
     Disadvantages: Slow, automatic.
     """
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import Matern, WhiteKernel,\
+        ConstantKernel
     kernel = ConstantKernel() *\
         Matern(length_scale=length_scale,
                length_scale_bounds=length_scale_bounds, nu=2.5) +\
@@ -37,6 +36,63 @@ def gp_filter(x, y,
     return np.squeeze(gp.predict(x[:, np.newaxis]))
 
 
+def local_gp_filter(x, y,
+                    nu=2.5,
+                    length_scale=1.0,
+                    length_scale_bounds=(1e-05, 100000.0),
+                    noise_level=1.0,
+                    noise_level_bounds=(1e-05, 100000.0),
+                    subsample=500,
+                    block_size=500,
+                    overlap=100,
+                    **kwargs):
+    """
+    Scalable version of gp_filter for long data series. The kernel
+    parameters are fitted to an evenly spaced subsample of at most
+    *subsample* points. The smoothed values are then predicted in blocks of
+    *block_size* points, each from a model conditioned on the block and
+    *overlap* points on both sides of it. The cost is linear in the number
+    of points. Series shorter than *subsample* are filtered with gp_filter.
+    Advantages:  Handles uneaqually sampled data, automatically adjusts
+                 parameters, fast for long series
+    Disadvantages: The overlap should be longer than the length scale of
+                   the data.
+    """
+    n = len(x)
+    if n <= subsample:
+        return gp_filter(x, y, nu=nu,
+                         length_scale=length_scale,
+                         length_scale_bounds=length_scale_bounds,
+                         noise_level=noise_level,
+                         noise_level_bounds=noise_level_bounds)
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import Matern, WhiteKernel,\
+        ConstantKernel
+    x = np.asarray(x, dtype=float)
+    # normalize with the statistics of the whole series, so that all blocks
+    # use the same model
+    y_mean = np.mean(y)
+    y_std = np.std(y) or 1.0
+    yn = (np.asarray(y, dtype=float) - y_mean)/y_std
+    kernel = ConstantKernel() *\
+        Matern(length_scale=length_scale,
+               length_scale_bounds=length_scale_bounds, nu=nu) +\
+        WhiteKernel(noise_level=noise_level,
+                    noise_level_bounds=noise_level_bounds)
+    ind = np.linspace(0, n - 1, subsample).astype(int)
+    gp = GaussianProcessRegressor(kernel=kernel)
+    gp.fit(x[ind, np.newaxis], yn[ind])
+    gp = GaussianProcessRegressor(kernel=gp.kernel_, optimizer=None)
+    ybar = np.empty(n)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        lo = max(start - overlap, 0)
+        hi = min(end + overlap, n)
+        gp.fit(x[lo:hi, np.newaxis], yn[lo:hi])
+        ybar[start:end] = gp.predict(x[start:end, np.newaxis])
+    return ybar*y_std + y_mean
+
+
 def butterworth_filter(x, y, cutoff=0.0125, width=0.0125, **kwargs):
     """
     Applies a butterworth filter with given cutoff and passband width
@@ -55,12 +111,14 @@ def butterworth_filter(x, y, cutoff=0.0125, width=0.0125, **kwargs):
     where 1 is the Nyquist frequency, pi radians/sample.
 
     """
+    import scipy.signal as signal
     N, Wn = signal.buttord(cutoff, cutoff+width, 1, 60)
     b, a = signal.butter(N, Wn)
     return signal.filtfilt(b, a, y, method="gust")  # zero phase filtering
 
 
 def fir_filter(x, y, cutoff=0.0125, width=0.0125, **kwargs):
+    import scipy.signal as signal
     numtaps, beta = signal.kaiserord(65, width)
     taps = signal.firwin(numtaps, cutoff, window=('kaiser', beta))
     return signal.filtfilt(taps, 1.0, y)  # zero phase filtering
@@ -84,6 +142,7 @@ def moving_average_filter(x, y, width=11, window='hanning', **kwargs):
           the smoothed signal
     """
 
+    import scipy.signal as signal
     if window not in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
         raise ValueError(
             "Window is on of 'flat', 'hanning', 'hamming', 'bartlett'," +
@@ -98,6 +157,7 @@ def moving_average_filter(x, y, width=11, window='hanning', **kwargs):
 
 
 def median_filter(x, y, width=10, **kwargs):
+    import scipy.signal as signal
     if width % 2 == 0:
         kernel_size = width+1
     else:
@@ -112,6 +172,7 @@ def none_filter(x, y, **kwargs):
 
 
 filter_types = {"gp": gp_filter,
+                "gp_local": local_gp_filter,
                 "median": median_filter,
                 "ma": moving_average_filter,
                 "none": none_filter
@@ -1,14 +1,40 @@
 # -*- coding: utf-8 -*-
-import tempfile
 import os
-import shutil
+import time
+import json
+import hashlib
 import numpy as np
-import subprocess
 from jinja2 import Environment,FileSystemLoader
 from pyropython import config as cfg
-from pyropython.utils import read_data
+from pyropython.utils import read_columns, process_data
+from pyropython.runner import Simulation, run_simulations
+from pyropython.resample import Resampler
+from pyropython.objective_functions import FusedObjective, fused_forms
+from pyropython.sandbox import SandboxPool
+from pyropython.scheduler import Resources
 import sys
 
+# Jinja2 environments of this process in format {root: environment}. The
+# environments cache the compiled templates, including the ones pulled in by
+# {% include %}. Jinja2 templates cannot be pickled, so each worker process
+# compiles its own, once.
+_environments = {}
+
+
+def get_template(fname, root="./"):
+    """ Returns the compiled Jinja2 template root/fname
+
+    The template is compiled on the first call and again only if the file
+    has been modified since. Included templates are handled the same way
+    when the template is rendered.
+    """
+    root = os.path.abspath(root)
+    env = _environments.get(root)
+    if env is None:
+        env = Environment(loader=FileSystemLoader(root), auto_reload=True)
+        _environments[root] = env
+    return env.get_template(fname)
+
 
 class Model:
     """ Class for evaluating simulation models
@@ -31,6 +57,17 @@ class Model:
                  objective_function=None,
                  tempdir=None,
                  objective_opts={},
+                 cache=None,
+                 jobs_per_eval=1,
+                 early_termination=None,
+                 keep_data=False,
+                 sandbox_dir=None,
+                 static_files=[],
+                 resources={},
+                 launch_command=None,
+                 slots=None,
+                 timeout=None,
+                 casename=None,
                  ):
         """ Initialize model
 
@@ -48,6 +85,43 @@ class Model:
             data_weights (:dict): data_weights for individual data points.
                 Given in format: {key: W}, where W is a weight vector.
                 NOTE: W should be equal length with corresponding exp_data.
+            cache (:ResultCache, optional): Cache for simulation results.
+                If given, the simulator is not run for input files that
+                have already been simulated.
+            jobs_per_eval (:int): Maximum number of templates simulated
+                concurrently during one evaluation. Defaults to 1.
+            early_termination (:dict, optional): Options for terminating
+                simulations early, {"factor": f, "interval": dt}. Every dt
+                seconds a lower bound for the objective is computed from the
+                output written so far, and the simulations are killed if the
+                bound exceeds f times the best objective found so far.
+            keep_data (:bool): If True, the simulation data is included in
+                the results put on the queue by fitness(). Needed for
+                archiving the results.
+            sandbox_dir (:string, optional): Directory for the working
+                directories of the simulations. Defaults to tempdir.
+            static_files (:list): Input files that do not depend on the
+                parameters. They are linked into each working directory
+                once, when the directory is created.
+            resources (:dict): Resources of the simulations of the templates
+                in format {template: Resources}. Defaults to one core.
+            launch_command (:string, optional): Command line of the
+                simulations, see Resources.launch_args(). Defaults to
+                "{command} {fname}".
+            slots (:CoreSlots, optional): Free cores of the node, shared by
+                all evaluations. If given, the simulations are started only
+                when the cores they need are free.
+            timeout (:dict, optional): Wall time limits of the simulations,
+                {"max_time": t, "factor": f, "min_samples": n,
+                "penalty": p, "retries": r, "retry_timeouts": False}. A
+                simulation is killed after t seconds, or after f times the
+                median runtime of the template once it has been run n times.
+                Simulations that fail are run again up to r times, killed
+                ones only if retry_timeouts is True. The objective of an
+                evaluation with a killed or failed simulation is p.
+            casename (:string, optional): Name of the case. Appended to the
+                incumbent and runtime files in tempdir, so that several cases
+                can share the folder.
         """
         self.exp_data = exp_data
         self.params = params
@@ -59,6 +133,36 @@ class Model:
         self.tempdir = tempdir
         self.objective_function = objective_function
         self.objective_opts = objective_opts
+        self.cache = cache
+        self.jobs_per_eval = jobs_per_eval
+        self.early_termination = early_termination
+        self.keep_data = keep_data
+        # working directories, reused between evaluations
+        self.sandbox_dir = sandbox_dir or tempdir
+        self.sandboxes = SandboxPool(self.sandbox_dir, static_files)
+        self.resources = resources
+        self.launch_command = launch_command or "{command} {fname}"
+        self.slots = slots
+        self.timeout = timeout
+        # interpolation weights from simulation to experimental times
+        self.resampler = Resampler()
+        # objective of all variables in one pass, if supported
+        self.fused_objective = None
+        if exp_data and objective_function in fused_forms:
+            self.fused_objective = FusedObjective(objective_function,
+                                                  exp_data,
+                                                  var_weights,
+                                                  data_weights,
+                                                  objective_opts)
+        if tempdir is not None:
+            suffix = "_" + casename if casename else ""
+            self.incumbent_file = os.path.join(tempdir,
+                                               "incumbent%s.txt" % suffix)
+            self.runtime_file = os.path.join(tempdir,
+                                             "runtimes%s.json" % suffix)
+        else:
+            self.incumbent_file = None
+            self.runtime_file = None
 
     def render_template(self, outname, template, x):
         """ Renders templates.
@@ -69,13 +173,17 @@ class Model:
             x (list like): parameter vector. The values in x will be used to
                 fill the variables in the templates. Values in x should be
                 given in the same order as the keys in self.params.
+
+        Returns:
+            digest (:string): sha256 hex digest of the rendered template
         """
-        f = open(outname, "tw")
         variables = {self.params[n][0]: var for n, var in enumerate(x)}
-        outfile = template.render(**variables)
-        f.writelines(outfile)
-        f.flush()
-        f.close()
+        h = hashlib.sha256()
+        with open(outname, "w", buffering=1 << 16) as f:
+            for chunk in template.generate(**variables):
+                f.write(chunk)
+                h.update(chunk.encode())
+        return h.hexdigest()
 
     def run_simulator(self, x):
         """ Renders templates, runs simulator and reads output
@@ -88,86 +196,311 @@ class Model:
                 key from the simulation dict, T is the indpendent variable
                 and F is the dependent variable
             pwd (:string): Working directory, where the simulation was run.
+                None if the data was read from the cache.
+            stats (:dict): Counters for events during the run, e.g.
+                cache hits and misses, timeouts, failures and retries, and
+                stats["runtime:<template>"], the runtime of the simulation of
+                each template in seconds.
+
+        The process-wide state (working directory, environment) is not
+        modified, so that several evaluations can run in threads of the same
+        process.
         """
         cwd = os.getcwd()
-        tempfile.tempdir = self.tempdir
         my_env = os.environ.copy()
-        my_env["OMP_NUM_THREADS"] = "1"
-        pwd = tempfile.mkdtemp(prefix="Cone_")
-        """ Jinja2 environments/templates cannot be pickled, so the Environments
-            need to be created here.
-        """
-        env = Environment(loader=FileSystemLoader(cwd))
-        os.chdir(pwd)
-        devnull = open(os.devnull, 'w')
+        pwd = self.sandboxes.acquire()
+        stats = {}
+        inputs = {}
         for fname in self.templates:
             outname = os.path.join(pwd, fname)
-            template = env.get_template(fname)
-            self.render_template(outname, template, x)
-            with  open("%s_stdout.txt" % fname,"wb") as out:
-                proc = subprocess.Popen([self.command, fname],
-                                         env=my_env,
-                                         cwd=pwd,
-                                         stderr=out,
-                                         stdout=out)
-            proc.wait()
-        devnull.close()
-        data = self.read_output()
-        os.chdir(cwd)
-        return data, pwd
-
-    def read_output(self):
+            template = get_template(fname, root=cwd)
+            inputs[fname] = self.render_template(outname, template, x)
+        if self.cache:
+            key = self.cache.key(inputs, self.command, self.simulation)
+            data = self.cache.get(key)
+            if data is not None:
+                # the sandbox holds only the inputs, not the output
+                self.sandboxes.release(pwd)
+                stats["cache_hits"] = 1
+                return data, None, stats
+            stats["cache_misses"] = 1
+        # for the timeouts and for backfilling the cores
+        medians = self.read_runtimes() if self.timeout or self.slots else {}
+
+        def simulation(fname):
+            res = self.resources.get(fname) or Resources()
+            env = dict(my_env, OMP_NUM_THREADS=str(res.threads))
+            args = res.launch_args(self.launch_command, self.command, fname)
+            return Simulation(self.command, fname, pwd, env=env, args=args,
+                              cores=res.cores,
+                              timeout=self.simulation_timeout(fname, medians),
+                              expected_runtime=medians.get(fname, [None])[0])
+        sims = [simulation(fname) for fname in self.templates]
+        if self.early_termination:
+            monitor = lambda: self.check_progress(pwd)
+            interval = self.early_termination.get("interval", 10.0)
+        else:
+            monitor = None
+            interval = None
+        timeout = self.timeout or {}
+        retries = timeout.get("retries", 0)
+        run = sims
+        while True:
+            completed = run_simulations(run,
+                                        max_parallel=self.jobs_per_eval,
+                                        monitor=monitor,
+                                        monitor_interval=interval,
+                                        slots=self.slots)
+            # timeouts are usually caused by the parameters, not transient
+            failed = [sim for sim in run if
+                      (sim.returncode and not sim.timed_out) or
+                      (sim.timed_out and timeout.get("retry_timeouts"))]
+            if not completed or not failed or retries == 0:
+                break
+            # run the failed simulations again
+            retries -= 1
+            stats["retries"] = stats.get("retries", 0) + len(failed)
+            run = [simulation(sim.fname) for sim in failed]
+            sims = [sim for sim in sims if sim not in failed] + run
+        if not completed:
+            data = self.read_output(cwd=pwd, partial=True)
+            stats["early_terminations"] = 1
+            return data, pwd, stats
+        timeouts = sum(sim.timed_out for sim in sims)
+        failures = sum(bool(sim.returncode) and not sim.timed_out
+                       for sim in sims) if self.timeout else 0
+        if timeouts or failures:
+            data = self.read_output(cwd=pwd, partial=True)
+            if timeouts:
+                stats["timeouts"] = timeouts
+            if failures:
+                stats["failures"] = failures
+            return data, pwd, stats
+        for sim in sims:
+            stats["runtime:" + sim.fname] = sim.runtime
+        data = self.read_output(cwd=pwd)
+        if self.cache:
+            self.cache.put(key, data)
+        return data, pwd, stats
+
+    def read_output(self, cwd="./", partial=False):
         """ Reads output as defined in Model.simulation dict and returns a
             dictionary.
 
+        Args:
+            cwd (:string): Directory containing the output files
+            partial (:bool): If True, the output is from a simulation that
+                is still running. Variables that cannot be read yet are
+                left out of the returned dictionary.
+
         Returns:
             data: Dictionary, with entries key: (T,F) where "key" is the key
             from the Model.simulation dict, T is the indpendent variable and
             F is the dependent variable
         """
-        data = {}
+        # group the data lines by file, so that each file is read only once
+        files = {}
         for key, line in self.simulation.items():
-            T, F = read_data(**line)
-            data[key] = T, F
+            fkey = (line["fname"], line.get("header", 1))
+            files.setdefault(fkey, []).append(key)
+        data = {}
+        for (fname, header), keys in files.items():
+            columns = set()
+            for key in keys:
+                line = self.simulation[key]
+                columns.update([line["ind_col_name"], line["dep_col_name"]])
+            try:
+                table = read_columns(fname,
+                                     columns=sorted(columns),
+                                     header=header,
+                                     cwd=cwd,
+                                     partial=partial)
+            except Exception:
+                # The file may be missing or half written
+                if not partial:
+                    raise
+                continue
+            for key in keys:
+                try:
+                    T, F = process_data(table, **self.simulation[key])
+                except Exception:
+                    if not partial:
+                        raise
+                    continue
+                if partial and len(T) < 2:
+                    continue
+                data[key] = T, F
         return data
 
-    def fitness(self, x, queue=None):
-        """Runs model, reads ouput and evalutes objective function.
+    def objective(self, data, partial=False):
+        """ Evaluates the objective function for simulation data
 
         Args:
-            x (list like): parameter vector. Values for use in the
-                Model.template(s). The values are given in the same order as
-                variables in Model.params.
-            queue (a Queue, optional): Queue for saving results. Defaults to
-                None. If provided,a tuple (xi,fi,pwd) is put() on the queue.
-                The valueas xi, fi and pwd are the paramater vector, fitness
-                value and working directory (string), respectively. The user is
-                responsible for cleaning up the working directories.
+            data (:dict): Dictionary, with entries key: (T,F), as returned by
+                Model.read_output()
+            partial (:bool): If True, the data is from an unfinished
+                simulation. Experimental points beyond the end of the
+                simulated data are treated as perfectly fitted and variables
+                missing from data do not contribute. For the objective
+                functions in nonnegative_objectives the result is then a
+                lower bound for the objective of the finished simulation.
 
         Returns:
-            fit (:float): Fitness value.
+            fit (:float): Objective function value.
         """
+        fused = self.fused_objective
+        if fused is not None and not partial:
+            keys, sdata = self.resampler.concatenated(self.exp_data, data)
+            if keys == fused.keys:
+                return float(fused(sdata))
         fit = 0
-        x = np.reshape(x, len(self.params))
-        data, pwd = self.run_simulator(x)
         weight_sum = 0.0
-        for key, d in data.items():
-            T, F = d
-            etime, edata = self.exp_data[key]
-            # interpolate simulation data to experiment
-            Fi = np.interp(etime, T, F)
+        # interpolate simulation data to experiment
+        resampled = self.resampler(self.exp_data, data)
+        for key, (etime, edata) in self.exp_data.items():
             weight = self.var_weights[key]
             weight_sum += weight
+            if key not in data:
+                continue
+            T, F = data[key]
+            Fi = resampled[key]
+            if partial:
+                Fi = np.where(etime <= T[-1], Fi, edata)
             opts = self.objective_opts
             fit += weight*self.objective_function(edata, Fi,
                                                   self.data_weights[key],
                                                   **opts)
-        fit = fit/weight_sum
+        return fit/weight_sum
+
+    def objective_batch(self, data_list):
+        """ Evaluates the objective function for many simulations at once
+
+        Args:
+            data_list (:list): list of dictionaries, with entries key: (T,F),
+                as returned by Model.read_output()
+
+        Returns:
+            fit (:array): Objective function values.
+        """
+        fit = np.zeros(len(data_list))
+        fused = self.fused_objective
+        rows = []
+        sdata = []
+        for n, data in enumerate(data_list):
+            if fused is not None:
+                keys, resampled = self.resampler.concatenated(self.exp_data,
+                                                              data)
+                if keys == fused.keys:
+                    rows.append(n)
+                    sdata.append(resampled)
+                    continue
+            fit[n] = self.objective(data)
+        if rows:
+            fit[rows] = fused(np.vstack(sdata))
+        return fit
+
+    def read_incumbent(self):
+        """ Returns the best objective value found so far, as written by
+            the Logger to Model.incumbent_file, or None if not available.
+        """
+        try:
+            with open(self.incumbent_file, "r") as f:
+                return float(f.read())
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def read_runtimes(self):
+        """ Returns the median runtimes of the templates, as written by the
+            Logger to Model.runtime_file, in format
+            {template: (median, number of runs)}, or {} if not available.
+        """
+        try:
+            with open(self.runtime_file, "r") as f:
+                return json.load(f)
+        except (OSError, TypeError, ValueError):
+            return {}
+
+    def simulation_timeout(self, fname, medians):
+        """ Wall time limit of the simulation of template fname in seconds,
+            or None if there is no limit. See Model.timeout.
+
+        Args:
+            fname (:string): the template
+            medians (:dict): median runtimes, see read_runtimes()
+        """
+        if not self.timeout:
+            return None
+        limits = []
+        if self.timeout.get("max_time"):
+            limits.append(self.timeout["max_time"])
+        median, count = medians.get(fname, (None, 0))
+        if (self.timeout.get("factor") and
+                count >= self.timeout.get("min_samples", 5)):
+            limits.append(self.timeout["factor"]*median)
+        return min(limits) if limits else None
+
+    def check_progress(self, pwd):
+        """ Checks if the simulations running in pwd should be terminated.
+
+        Returns:
+            True if the lower bound of the objective computed from the
+            output written so far exceeds early_termination["factor"] times
+            the best objective value found so far.
+        """
+        f_best = self.read_incumbent()
+        if f_best is None:
+            return False
+        data = self.read_output(cwd=pwd, partial=True)
+        bound = self.objective(data, partial=True)
+        return bound > self.early_termination.get("factor", 2.0)*f_best
+
+    def fitness(self, x, queue=None):
+        """Runs model, reads ouput and evalutes objective function.
+
+        Args:
+            x (list like): parameter vector. Values for use in the
+                Model.template(s). The values are given in the same order as
+                variables in Model.params.
+            queue (a Queue, optional): Queue for saving results. Defaults to
+                None. If provided,a tuple (fi,xi,pwd,stats,data) is put() on
+                the queue. The valueas fi, xi, pwd and stats are the fitness
+                value, paramater vector, working directory (string) and run
+                statistics (dict), respectively. data is the simulation data
+                as returned by read_output() if Model.keep_data is True and
+                None otherwise. stats["wall_time"] is the wall time of the
+                evaluation in seconds. The working directory is only kept if
+                fi is better than the incumbent (see read_incumbent()) and
+                the simulations were run, and pwd is None otherwise. The user is responsible for
+                cleaning up the kept working directories.
+
+        Returns:
+            fit (:float): Fitness value.
+        """
+        start = time.perf_counter()
+        x = np.reshape(x, len(self.params))
+        data, pwd, stats = self.run_simulator(x)
+        if "timeouts" in stats or "failures" in stats:
+            fit = self.timeout.get("penalty", 100.0)
+        else:
+            # for terminated simulations, use the lower bound
+            fit = self.objective(data, partial="early_terminations" in stats)
+        stats["wall_time"] = time.perf_counter() - start
         # possibly save the results.
         if queue:
-            queue.put((fit, x, pwd))
-        else:
-            shutil.rmtree(pwd)
+            # keep the directory if it may be promoted by the Logger,
+            # otherwise reuse it
+            f_best = self.read_incumbent()
+            if pwd is None:
+                pass
+            elif f_best is None or fit < f_best:
+                self.sandboxes.detach(pwd)
+            else:
+                self.sandboxes.release(pwd)
+                pwd = None
+            queue.put((fit, x, pwd, stats,
+                       data if self.keep_data else None))
+        elif pwd is not None:
+            self.sandboxes.release(pwd)
         return fit
 
     def penalized_fitness(self, x, c=100, queue=None):
@@ -192,7 +525,7 @@ class Model:
         if res <= 1:
             res += self.fitness(x, queue)
         elif queue:
-             queue.put((res, x, None))
+             queue.put((res, x, None, {}, None))
         return res
 
     def get_bounds(self):
@@ -231,6 +564,22 @@ class Model:
         print()
         print("Command: %s" % self.command) 
         print("Temp dir: %s" % self.tempdir) 
+        print("Sandbox dir: %s" % self.sandbox_dir)
+        if self.sandboxes.static_files:
+            print("Static files: %s" % ", ".join(self.sandboxes.static_files))
+        print("Concurrent simulations per evaluation: %d" % self.jobs_per_eval)
+        if self.slots is not None:
+            print("Cores: %d%s" % (self.slots.num_cores,
+                                   " (pinned)" if self.slots.pin else ""))
+            print("Launch command: %s" % self.launch_command)
+            for name, res in self.resources.items():
+                print("%30s: %s" % (name, res))
+        if self.early_termination:
+            print("Early termination: %s" % self.early_termination)
+        if self.timeout:
+            print("Timeout: %s" % self.timeout)
+        if self.cache:
+            print("Result cache: %s" % self.cache.cache_dir)
         print("Objective function: %s " % self.objective_function.__name__) 
         print("Objective options") 
         print(self.objective_opts)
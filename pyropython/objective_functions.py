@@ -5,7 +5,8 @@ Created on Thu Mar 22 15:02:16 2018
 @author: tstopi
 """
 
-from numpy import mean, abs, var, percentile, maximum, finfo
+from numpy import (mean, abs, var, percentile, maximum, finfo,
+                   broadcast_to, concatenate)
 
 
 def mse(edata, sdata, weights, **kwargs):
@@ -42,7 +43,7 @@ def standardized_moment(edata, sdata, weights, p=1):
     """
 
     dev = (weights*abs(edata-sdata))**p
-    return mean(dev)/var(weights*edata)**(p/2.0)
+    return mean(dev, axis=-1)/var(weights*edata)**(p/2.0)
 
 def relative_error(edata, sdata, weights, eps=0.001):
     """
@@ -63,7 +64,7 @@ def relative_error(edata, sdata, weights, eps=0.001):
     minval = eps*mean(abs(edata))
     denumer = maximum(abs(edata),minval) 
     dev = weights*abs(edata-sdata)/denumer
-    return mean(dev)
+    return mean(dev, axis=-1)
 
 def gpyro(edata, sdata, weights,eps=0.01,p=1):
     """
@@ -71,7 +72,15 @@ def gpyro(edata, sdata, weights,eps=0.01,p=1):
         mean [ w_i*( y_i / (abs(y_i-yhat_i) + eps * y_i)^p ]
     """
     dev = abs(edata/(abs(edata-sdata) + eps*edata))
-    return -1*mean(weights*dev**p)
+    return -1*mean(weights*dev**p, axis=-1)
+
+# All objective functions also accept sdata of shape (n, len(edata)) and then
+# return the n objective values of the rows. This is used for re-scoring many
+# simulations at once, see pyropython.rescore
+
+# Objective functions that are means of non-negative terms. For these, the
+# objective computed with part of the terms set to zero is a lower bound
+nonnegative_objectives = [standardized_moment, mse, abs_dev, relative_error]
 
 objective_functions = {"standardized_moment": standardized_moment,
                        "mse": mse,
@@ -80,6 +89,96 @@ objective_functions = {"standardized_moment": standardized_moment,
                        "gpyro": gpyro}
 
 
+def _moment_form(edata, weights, p=1, **kwargs):
+    """ standardized_moment as (scale*abs(y_i-yhat_i))^p terms """
+    return weights, 1.0/(len(edata)*var(weights*edata)**(p/2.0)), p
+
+
+def _mse_form(edata, weights, **kwargs):
+    return _moment_form(edata, weights, p=2)
+
+
+def _abs_dev_form(edata, weights, **kwargs):
+    return _moment_form(edata, weights, p=1)
+
+
+def _relative_error_form(edata, weights, eps=0.001):
+    """ relative_error as scale*abs(y_i-yhat_i) terms """
+    minval = eps*mean(abs(edata))
+    denumer = maximum(abs(edata), minval)
+    return weights/denumer, 1.0/len(edata), 1
+
+
+# Objective functions that can be written as sum_i c_i*(s_i*abs(y_i-yhat_i))^p
+# with c_i and s_i depending only on the experimental data. The functions
+# return the scales s_i, the coefficients c_i and the exponent p.
+fused_forms = {standardized_moment: _moment_form,
+               mse: _mse_form,
+               abs_dev: _abs_dev_form,
+               relative_error: _relative_error_form}
+
+
+class FusedObjective:
+    """ Objective function of all variables evaluated in one pass
+
+    The experimental data of all variables is concatenated and the
+    quantities that depend only on the experimental data are computed once.
+    The weighted objective, sum_k var_weights[k]*f(edata_k, sdata_k) divided
+    by the sum of var_weights, is then
+
+        sum_i coef_i * (scale_i*abs(edata_i - sdata_i))^p
+
+    where i runs over the concatenated data points. Only the objective
+    functions in fused_forms are supported.
+    """
+
+    # arrays that can be placed in shared memory, see pyropython.workers
+    array_names = ("edata", "scale", "coef")
+
+    def __init__(self, objective_function, exp_data, var_weights,
+                 data_weights, objective_opts=None):
+        form = fused_forms[objective_function]
+        objective_opts = objective_opts or {}
+        self.keys = list(exp_data)
+        weight_sum = sum(var_weights[key] for key in self.keys)
+        edata = []
+        scale = []
+        coef = []
+        self.slices = []
+        start = 0
+        for key in self.keys:
+            etime, ed = exp_data[key]
+            s, c, self.p = form(ed, data_weights[key], **objective_opts)
+            edata.append(ed)
+            scale.append(broadcast_to(s, ed.shape))
+            coef.append(broadcast_to(c*var_weights[key]/weight_sum,
+                                     ed.shape))
+            self.slices.append(slice(start, start + len(ed)))
+            start += len(ed)
+        self.edata = concatenate(edata).astype(float)
+        self.scale = concatenate(scale).astype(float)
+        self.coef = concatenate(coef).astype(float)
+
+    def __call__(self, sdata):
+        """ Evaluates the objective
+
+        Args:
+            sdata (:array): Simulation data interpolated to the experimental
+                times and concatenated in the order of self.keys. Shape (M,)
+                or (N, M) for N simulations.
+
+        Returns:
+            fit (:float or :array): objective value, or N values
+        """
+        dev = abs(self.edata - sdata)
+        dev *= self.scale
+        if self.p == 2:
+            dev *= dev
+        elif self.p != 1:
+            dev **= self.p
+        return dev @ self.coef
+
+
 def get_objective_function(name="mse"):
     """
     Returns the objective function with the given name
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import numpy as np
+from collections import Counter
 from functools import partial
 from pyropython.initial_design import make_initial_design
-import multiprocessing
-import multiprocessing.managers
-from shutil import rmtree, copytree
+from pyropython import workers
+from queue import Queue
+import threading
+from pyropython.utils import BackgroundDeleter, move_dir
+from pyropython.archive import Archive
+from pyropython.scheduler import RuntimeModel
 from traceback import print_exception
 import time
+import json
 import os
 
 
@@ -15,31 +20,64 @@ class Logger:
     """
     Class for recording optimization algorithm progress.
 
-    This class is supposed to consume the queue created by model.fitness()
+    This class is supposed to consume the queue created by model.fitness().
+    Results returned by the functions in pyropython.workers are added to
+    the queue with Logger.add().
     """
 
     def __init__(self,
                  params=None,
                  logfile="log.csv",
-                 evalfile="evals_log.csv",
+                 evalfile=None,
                  queue=None,
                  lock=None,
-                 best_dir="Best/"):
+                 best_dir="Best/",
+                 incumbent_file=None,
+                 runtime_file=None,
+                 max_backlog=100,
+                 archive_dir=None,
+                 archive_flush_interval=60.0):
         self.x_best = None
         self.f_best = np.inf
         self.xi = None
         self.fi = np.inf
         self.iter = 0
         self.logfile = logfile
+        # one line per evaluation, with the wall time
+        if evalfile is None:
+            evalfile = os.path.join(os.path.dirname(logfile),
+                                    "evals_" + os.path.basename(logfile))
+        self.evalfile = evalfile
+        self.num_evals = 0
+        # runtimes of the simulations, for scheduling
+        self.runtime_model = RuntimeModel([bounds for name, bounds in params])
+        self.runtime_file = runtime_file
         self.Xi = []
         self.Fi = []
         self.Fevals = []
         self.params = params
+        if queue is None:
+            queue = Queue()
         self.queue = queue
-        self.lock = multiprocessing.Lock()
+        self.lock = threading.Lock()
         self.best_dir = best_dir
+        self.incumbent_file = incumbent_file
+        # a value left by a previous run would mislead the evaluations
+        if incumbent_file and os.path.exists(incumbent_file):
+            os.remove(incumbent_file)
+        if runtime_file and os.path.exists(runtime_file):
+            os.remove(runtime_file)
+        # working directories are deleted in the background
+        self.deleter = BackgroundDeleter(max_backlog)
+        self.num_promoted = 0
+        if archive_dir is not None:
+            self.archive = Archive(archive_dir, params,
+                                   flush_interval=archive_flush_interval)
+        else:
+            self.archive = None
         self.start_time = time.perf_counter()
         self.iteration_time = 0
+        self.stats = Counter()
         self.x_best = np.zeros(len(self.params))
         self.xi = self.x_best
         logfile = open(self.logfile, 'w+')
@@ -49,12 +87,17 @@ class Logger:
                           ["Objective", "Best Objective", "Fevals","Time"])
         logfile.write(header+"\n")
         logfile.close()
+        with open(self.evalfile, "w") as evalfile:
+            header = ",".join(["Evaluation"] +
+                              [name for name, bounds in self.params] +
+                              ["Objective", "Wall time"])
+            evalfile.write(header + "\n")
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, tb):
-        self.consume_queue()
+        self.close()
         if exc_type is not None:
             print_exception(exc_type, exc_value, tb)
 
@@ -82,10 +125,29 @@ class Logger:
             self.print_iteration()
             self.log_iteration()
 
+    def add(self, result):
+        """ Add a result returned by a function in pyropython.workers to
+            the queue.
+
+        Args:
+            result (:tuple): (records, sent), where records is a list of
+                (fi, xi, pwd, stats, data) tuples and sent is the time.time() when
+                the worker returned the result.
+        Returns:
+            fi (:list): objective values in records
+        """
+        records, sent = result
+        # time from the worker returning the result to it arriving here
+        self.stats["ipc_messages"] += 1
+        self.stats["ipc_time"] += max(time.time() - sent, 0.0)
+        for record in records:
+            self.queue.put(record)
+        return [record[0] for record in records]
+
     def log_points(self, Xi, yi):
         # Add points to the queue
         for n,xi in enumerate(Xi):
-            self.queue.put( (yi[n], xi, None) )
+            self.queue.put( (yi[n], xi, None, {}, None) )
 
 
 
@@ -96,10 +158,30 @@ class Logger:
             queue = self.queue
         f_ = []
         x_ = []
+        f_best_old = self.f_best
+        evals = []
+        new_runtimes = False
         while not queue.empty():
-            fi, xi, pwd = queue.get()
+            fi, xi, pwd, stats, data = queue.get()
+            self.stats.update(stats)
+            # points read from a file or outside the bounds are not evaluated
+            if "wall_time" in stats:
+                evals.append((fi, xi, stats["wall_time"]))
+            runtimes = {name[len("runtime:"):]: value for name, value in stats.items()
+                        if name.startswith("runtime:")}
+            if runtimes:
+                self.runtime_model.add(xi, runtimes)
+                new_runtimes = True
+            # results of terminated simulations are incomplete
+            if (self.archive is not None and data is not None and
+                    "early_terminations" not in stats and
+                    "timeouts" not in stats and
+                    "failures" not in stats):
+                self.archive.append(fi, xi, data)
             f_.append(fi)
             x_.append(xi)
+            # only a strictly better point replaces the output in best_dir
+            improved = fi < self.f_best
             # record best value seen
             if self.f_best:
                 if self.f_best > fi:
@@ -109,17 +191,26 @@ class Logger:
                 self.f_best = fi
                 self.x_best = xi
             # save output of the best run
-            if fi <= self.f_best:
+            if improved:
                 if pwd is not None:
-                    if os.path.exists(self.best_dir):
-                        rmtree(self.best_dir)
-                    copytree(pwd, self.best_dir)
+                    self.promote(pwd)
+                elif "cache_hits" in stats:
+                    print("WARNING: optimum read from the result cache, "
+                          "its output is not in %s." % self.best_dir)
                 else:
                     print("WARNING: optimum found outside the variable bounds.")
             # delete files when done
-            if pwd is not None:
-                rmtree(pwd)
-
+            elif pwd is not None:
+                self.deleter.remove(pwd)
+
+        if self.archive is not None:
+            self.archive.flush_due()
+        if self.incumbent_file and self.f_best < f_best_old:
+            self.write_incumbent()
+        if self.runtime_file and new_runtimes:
+            self.write_runtimes()
+        if evals:
+            self.log_evals(evals)
         # record the best form this iteration
         self.iter += 1
         self.Fevals.append(len(f_))
@@ -133,6 +224,55 @@ class Logger:
         self.iteration_time = current_time - self.start_time
         self.start_time = current_time
 
+    def promote(self, pwd):
+        """ Move working directory pwd to self.best_dir.
+
+            The previous best directory is renamed and deleted in the
+            background. If pwd is not found, e.g. because it was written by a
+            worker on another node without a shared file system, best_dir is
+            left as it is.
+        """
+        if not os.path.isdir(pwd):
+            print("WARNING: working directory %s of the best point not "
+                  "found. Not copied to %s." % (pwd, self.best_dir))
+            return
+        best_dir = os.path.normpath(self.best_dir)
+        if os.path.exists(best_dir):
+            self.num_promoted += 1
+            old = "%s.old.%d" % (best_dir, self.num_promoted)
+            os.rename(best_dir, old)
+            self.deleter.remove(old)
+        if not move_dir(pwd, best_dir):
+            self.deleter.remove(pwd)
+
+    def close(self):
+        """ Consume the queue, write the archive and wait for the pending
+            deletions.
+        """
+        self.consume_queue()
+        if self.archive is not None:
+            self.archive.flush()
+        self.deleter.close()
+
+    def write_incumbent(self):
+        """ Write the best objective value to self.incumbent_file, where the
+            running evaluations can read it. See Model.read_incumbent()
+        """
+        tmpname = self.incumbent_file + ".tmp"
+        with open(tmpname, "w") as f:
+            f.write(repr(float(self.f_best)))
+        os.replace(tmpname, self.incumbent_file)
+
+    def write_runtimes(self):
+        """ Write the median runtimes of the templates to self.runtime_file,
+            for the timeouts of the running evaluations. See
+            Model.read_runtimes()
+        """
+        tmpname = self.runtime_file + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump(self.runtime_model.medians(), f)
+        os.replace(tmpname, self.runtime_file)
+
     def print_iteration(self):
         """ prints the solution from current iteration """
         # Print info
@@ -149,6 +289,10 @@ class Logger:
         msg = "       {name} :"
         for n, (name, bounds) in enumerate(self.params):
             print(msg.format(name=name), self.x_best[n])
+        if self.stats:
+            print("            run statistics:")
+            for name, value in sorted(self.stats.items()):
+                print(msg.format(name=name), value)
         print(flush=True)
 
     def log_iteration(self):
@@ -175,70 +319,172 @@ class Logger:
         logfile.close()
         pass
 
-    def get_log(self):
-        return self.x_best, self.f_best, self.Xi, self.Fi
-
-
-# This needs to be defined at the top of the module.
-# Otherwise won't work on windows
-class MyManager(multiprocessing.managers.BaseManager): 
-    pass
-
-# Make a proxy class in order to share the Logger between Processes
-# This is ugly , but I _really_ want to use the Logger class as callback
-# this can only be done if the Logger class is shared between processes
-def Manager():
-    m = MyManager()
-    m.start()
-    return m 
+    def log_evals(self, evals):
+        """ Append evaluations to the evaluation log
 
-# There is a  bug in multiprocessing module in python 3.6 and 3.7
-# at least. Monkey patch The Autoproxy
-# See: https://stackoverflow.com/a/9079062
-import sys
-if sys.version_info[1]in [6,7]:
-    # Backup original AutoProxy function
-    backup_autoproxy = multiprocessing.managers.AutoProxy
+        Args:
+            evals (:list): (fi, xi, wall_time) tuples
+        """
+        with open(self.evalfile, "a") as evalfile:
+            for fi, xi, wall_time in evals:
+                self.num_evals += 1
+                line = (["%d" % self.num_evals] + ["%.6g" % v for v in xi] +
+                        ["%.6e" % fi, "%.3f" % wall_time])
+                evalfile.write(",".join(line) + "\n")
 
-    # Defining a new AutoProxy that handles unwanted key argument 'manager_owned'
-    def redefined_autoproxy(token, serializer, manager=None, authkey=None,
-              exposed=None, incref=True, manager_owned=True):
-        # Calling original AutoProxy without the unwanted key argument
-        return backup_autoproxy(token, serializer, manager, authkey,
-                         exposed, incref)
+    def get_log(self):
+        return self.x_best, self.f_best, self.Xi, self.Fi
 
-    # Updating AutoProxy definition in multiprocessing.managers package
-    multiprocessing.managers.AutoProxy = redefined_autoproxy
 
-MyManager.register("Logger",Logger)
-MyManager.register("Lock",multiprocessing.Lock)
-MyManager.register("Queue",multiprocessing.Queue)
+def make_logger(case, runopts):
+    """ Create the Logger of the optimization of case with the options runopts
+    """
+    return Logger(params=case.params,
+                  logfile=runopts.logfilename,
+                  best_dir=runopts.output_dir,
+                  incumbent_file=case.incumbent_file,
+                  runtime_file=case.runtime_file,
+                  archive_dir=runopts.archive_dir,
+                  archive_flush_interval=runopts.archive_flush_interval)
+
+
+def map_longest_first(executor, fun, x, log):
+    """ Same as executor.map(fun, x), but the points with the longest
+        predicted runtime (see Logger.runtime_model) are submitted first.
+        The slow evaluations then do not delay the end of the batch.
+
+    Returns:
+        results (:generator): the results, in the order of x
+    """
+    futures = {}
+    for n in log.runtime_model.order(x):
+        futures[n] = executor.submit(fun, x[n])
+    try:
+        for n in range(len(x)):
+            yield futures[n].result()
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def ask_pending(optimizer, n, pending, strategy="cl_min"):
+    """ Asks a skopt optimizer for n points, while the points pending are
+        still being evaluated.
+
+    The pending points are told to a copy of the optimizer with a made-up
+    objective value, as in the constant liar strategy of optimizer.ask().
+    The new points are therefore not placed on top of the running ones.
+
+    Args:
+        optimizer (:skopt.Optimizer): the optimizer
+        n (:int): number of points
+        pending (:list): points being evaluated
+        strategy (:string): "cl_min", "cl_mean" or "cl_max", the lie is the
+            minimum, mean or maximum of the objective values told so far.
+    Returns:
+        x (:list): n points
+    """
+    if not pending:
+        return optimizer.ask(n_points=n, strategy=strategy)
+    reduce = {"cl_min": np.min, "cl_mean": np.mean, "cl_max": np.max}[strategy]
+    if optimizer.yi:
+        # (objective, log of the time) for the "ps" acquisition functions
+        lie = reduce(optimizer.yi, axis=0)
+        lie = tuple(lie) if np.ndim(lie) else float(lie)
+    elif "ps" in optimizer.acq_func:
+        lie = (0.0, np.log(np.finfo(float).max))
+    else:
+        lie = 0.0
+    opt = optimizer.copy(
+        random_state=optimizer.rng.randint(0, np.iinfo(np.int32).max))
+    opt._tell(list(pending), [lie]*len(pending))
+    return opt.ask(n_points=n, strategy=strategy)
+
+
+def evaluate_async(executor, fun, x, ask, tell, num_evals, runopts, log):
+    """ Evaluate points asynchronously.
+
+    Keeps runopts.num_jobs evaluations running at all times. As soon as
+    evaluations finish, their results are given to tell() and new points
+    from ask() are submitted, one for each free job. The points in x are
+    evaluated first, longest predicted runtime first. The results are added
+    to the logger, which is called after every runopts.num_points
+    evaluations.
+
+    Args:
+        executor: concurrent.futures executor
+        fun: function to be evaluated, e.g. workers.fitness
+        x (list): list of points to be evaluated first
+        ask: function ask(n, pending) returning a list of n new points,
+            given the list of points still being evaluated, e.g.
+            partial(ask_pending, optimizer)
+        tell: function accepting a point and its function value
+        num_evals (int): total number of function evaluations
+        runopts: run options
+        log: Logger
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    todo = [x[n] for n in log.runtime_model.order(x)]
+    running = {}
+    num_submitted = 0
+    num_done = 0
+    while running or num_submitted < num_evals:
+        free = min(runopts.num_jobs - len(running), num_evals - num_submitted)
+        new = todo[:free]
+        del todo[:free]
+        if len(new) < free:
+            new += ask(free - len(new), list(running.values()) + new)
+        for xi in new:
+            running[executor.submit(fun, xi)] = xi
+            num_submitted += 1
+        done, not_done = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            xi = running.pop(future)
+            tell(xi, log.add(future.result())[0])
+            num_done += 1
+            if num_done % runopts.num_points == 0:
+                log()
+    if num_done % runopts.num_points != 0:
+        log()
 
 
 
 
 def dummy(case, runopts, executor, initial_design, fvals = None):
     """ optimize case using monte carlo sampling
+
+    The executor should be created with pyropython.workers.worker_pool
     """
-    files = Manager().Queue()
-    fun = partial(case.fitness, queue=files)
+    fun = workers.fitness
     x = initial_design
     N_iter = 0
     print("Begin random optimization.")
-    with Logger(params=case.params,
-                queue=files,
-                logfile=runopts.logfilename,
-                best_dir = runopts.output_dir) as log:
+    with make_logger(case, runopts) as log:
         if fvals is not None:
             log.log_points(x, fvals)
             x = make_initial_design(name="rand",
                                     num_points=runopts.num_points,
                                     bounds=case.get_bounds())
+        if runopts.asynchronous:
+            num_evals = len(x) + (runopts.max_iter-1)*runopts.num_points
+            print("Asynchronous evaluation of {num:d} points.".format(
+                  num=num_evals), flush=True)
+            evaluate_async(executor, fun, x,
+                           ask=lambda n, pending: list(make_initial_design(
+                                name="rand",
+                                num_points=n,
+                                bounds=case.get_bounds())),
+                           tell=lambda xi, yi: None,
+                           num_evals=num_evals,
+                           runopts=runopts,
+                           log=log)
+            return log.x_best, log.f_best, log.Xi, log.Fi
         while N_iter < runopts.max_iter:
             # evaluate points (in parallel)
             print("Evaluating {num:d} points.".format(num=len(x)),
                   flush=True)
-            y = list(executor.map(fun, x))
+            for result in map_longest_first(executor, fun, x, log):
+                log.add(result)
             log()
             N_iter += 1
             if N_iter < runopts.max_iter:
@@ -249,17 +495,57 @@ def dummy(case, runopts, executor, initial_design, fvals = None):
         return log.x_best, log.f_best, log.Xi, log.Fi
 
 
+def _proc_optimizer_opts(args_dict):
+    """Process optimizer kwargs. 
+    
+    This is meainly used to set different defaults
+    for skopt.learn - Tree regressors. Called when the optimizer is
+    created, so that skopt is imported only if it is used.
+    """
+    from skopt.utils import cook_estimator
+    if args_dict is None:
+        return {}
+    args_dict = dict(args_dict)
+    if "base_estimator" in args_dict:
+        if args_dict["base_estimator"]=="ET":
+            args = {"n_estimators": 100,
+                    "min_samples_leaf":3,
+                    "max_depth":None,
+                    "bootstrap":False}
+        elif args_dict["base_estimator"]=="ET2":
+            args = {"n_estimators": 1000,
+                    "min_samples_leaf":1,
+                    "max_depth":None,
+                    "bootstrap":False}
+            args_dict["base_estimator"]="ET"
+        elif args_dict["base_estimator"]=="RF":
+            args = {"n_estimators": 100,
+                    "min_samples_leaf": 1,
+                    "max_depth": None,
+                    "bootstrap": True}
+        elif args_dict["base_estimator"]=="GBRT":
+            args = None
+        else:
+            args = None
+        if args: 
+            args_dict["base_estimator"] = cook_estimator(
+                                            args_dict["base_estimator"],
+                                            **args)
+    return args_dict
+
+
 def skopt(case, runopts, executor, initial_design, fvals = None):
     """ optimize case using scikit-optimize
+
+    The executor should be created with pyropython.workers.worker_pool
     """
     from skopt import Optimizer
     from skopt.acquisition import gaussian_lcb
     from scipy.optimize import minimize, differential_evolution
 
     optimizer = Optimizer(dimensions=case.get_bounds(),
-                          **runopts.optimizer_opts)
-    files = Manager().Queue()
-    fun = partial(case.fitness, queue=files)
+                          **_proc_optimizer_opts(runopts.optimizer_opts))
+    fun = workers.fitness
     x = initial_design
     N_iter = 0
     print()
@@ -278,10 +564,7 @@ def skopt(case, runopts, executor, initial_design, fvals = None):
     print("Points per iteration: %d " % runopts.num_points)
 
 
-    with Logger(params=case.params,
-                queue=files,
-                logfile=runopts.logfilename,
-                best_dir = runopts.output_dir) as log:
+    with make_logger(case, runopts) as log:
         if fvals is not None:
             print("Initializing metamodel with given points")
             log.log_points(x,fvals)
@@ -290,10 +573,22 @@ def skopt(case, runopts, executor, initial_design, fvals = None):
             y_pred = optimizer.models[-1].predict(x)
         else:
             y_pred = None
+        if runopts.asynchronous:
+            num_evals = len(x) + (runopts.max_iter-1)*runopts.num_points
+            print("Asynchronous evaluation of {num:d} points.".format(
+                  num=num_evals), flush=True)
+            evaluate_async(executor, fun, x,
+                           ask=partial(ask_pending, optimizer),
+                           tell=optimizer.tell,
+                           num_evals=num_evals,
+                           runopts=runopts,
+                           log=log)
+            return log.x_best, log.f_best, log.Xi, log.Fi
         while N_iter < runopts.max_iter:
             # evaluate points (in parallel)
             print("Evaluating {num:d} points.".format(num=len(x)))
-            y = list(executor.map(fun, x))
+            y = [log.add(result)[0]
+                 for result in map_longest_first(executor, fun, x, log)]
             log()
             if y_pred is not None:
                 err = np.abs(np.array(y) - np.array(y_pred))
@@ -310,20 +605,12 @@ def skopt(case, runopts, executor, initial_design, fvals = None):
 
 def multistart(case, runopts, executor, initial_design, fvals = None):
     """ optimize case using multiple random starts and scipy.minimize
-    """
-    from scipy.optimize import minimize
-
 
-    m= Manager()
-    lock = m.Lock()
-    queue = m.Queue()
-    log = m.Logger(params=case.params,
-                   queue=queue,
-                   lock=lock,
-                   logfile=runopts.logfilename,
-                   best_dir = runopts.output_dir) 
+    The executor should be created with pyropython.workers.worker_pool
+    """
+    log = make_logger(case, runopts)
 
-    fun = partial(case.penalized_fitness, queue=queue)
+    fun = workers.penalized_fitness
 
     x = initial_design
 
@@ -332,7 +619,8 @@ def multistart(case, runopts, executor, initial_design, fvals = None):
     if fvals is None:
         print("Evaluating {num:d} random points.".format(num=len(x)),
                   flush=True)
-        y = list(executor.map(fun, x))
+        y = [log.add(result)[0]
+             for result in map_longest_first(executor, fun, x, log)]
     else:
         y = fvals
         log.log_points(x,y)
@@ -354,15 +642,18 @@ def multistart(case, runopts, executor, initial_design, fvals = None):
             # evaluate points (in parallel)
             x_eval = candidates[cur:cur+runopts.num_points]
             cur = cur + runopts.num_points
-            task = partial(minimize, fun,
+            # The minimizations run in the workers, and all evaluations
+            # are returned when the minimization finishes
+            task = partial(workers.minimize,
                            method="Nelder-Mead",
-                           callback = log.callback,
                            options={'ftol': 0.001,
                                     'adaptive': True})
             print("Minimizing {num:d} starting points.".format(num=runopts.num_points),
                   flush=True)
 
-            y = list(executor.map(task, x_eval))
+            for result in executor.map(task, x_eval):
+                log.add(result)
+            log.callback()
             msg = "Used {N:d} function evaluations. "
             x_best, f_best, Xi, Fi = log.get_log()
             print(msg.format(N=len(Fi[-1])))
@@ -371,22 +662,19 @@ def multistart(case, runopts, executor, initial_design, fvals = None):
         return x_best, f_best, Xi, Fi
     finally:
             log.callback()
+            log.close()
 
         
 
 def differential_evolution(case, runopts, executor, initial_design, fvals):
     """ optimize case using scipy.optimize.differential_evolution
     """
-    files = Manager().Queue()
-    fun = partial(case.fitness, queue=files)
     N_iter = 0
     print("Begin differential evolution")
     print("NOTE: parallel evaluation not currently supported. Maybe in future scipy")
     from scipy.optimize import differential_evolution as de
-    with Logger(params=case.params,
-                queue=files,
-                logfile=runopts.logfilename,
-                best_dir = runopts.output_dir) as log:
+    with make_logger(case, runopts) as log:
+            fun = partial(case.fitness, queue=log.queue)
             y = de(fun,bounds=case.get_bounds(),
                    maxiter = runopts.max_iter,
                    callback = log.callback)
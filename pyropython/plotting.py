@@ -6,7 +6,6 @@ from pyropython.utils import read_data, ensure_dir
 from pyropython.config import read_plots
 import argparse
 import os
-import sklearn.ensemble as skl
 
 
 
@@ -71,6 +70,7 @@ def plot_sim(cfg):
 
 
 def plot_feature_importance(cfg, result):
+    import sklearn.ensemble as skl
     model = result.models[-1]
     X = result.Xi
     if not (isinstance(model, skl.RandomForestRegressor) or
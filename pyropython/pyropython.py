@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import sklearn.ensemble as skl
 from pyropython.initial_design import make_initial_design
-from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import freeze_support
 import numpy as np
 import argparse
 from pyropython.config import read_config
 from pyropython.utils import ensure_dir, read_initial_design
 from pyropython.optimizer import get_optimizer
+from pyropython.workers import get_executor
 import sys
 from datetime import datetime
 
@@ -17,12 +16,12 @@ def optimize_model(case, run_opts):
     Main optimization loop
     """
 
-    """ these can perhaps be changed later to use MPI
-       The executor needs to be *PROCESS*PoolExecutor, not *THREAD*Pool
-       The Model class and associated functions are not thread safe.
+    """ The evaluations run in worker processes, which receive the Model once
+       when they are started, in threads of this process (executor: thread)
+       or in workers on other nodes (executor: socket or mpi).
     """
     print("Numebr of parallel jobs: %d" % run_opts.num_jobs)
-    ex = ProcessPoolExecutor(run_opts.num_jobs)
+    print("Executor: %s" % run_opts.executor)
     print("Optimizer name: %s" % run_opts.optimizer_name )
     optimizer = get_optimizer(run_opts.optimizer_name)
 
@@ -44,7 +43,10 @@ def optimize_model(case, run_opts):
 
     startTime = datetime.now()
     print('\nTime: ', startTime)
-    x_best, f_best, Xi, Fi = optimizer(case, run_opts, ex, initial_design, fvals)
+    pool = get_executor(run_opts.executor)
+    with pool(case, run_opts.num_jobs, **run_opts.executor_opts) as ex:
+        x_best, f_best, Xi, Fi = optimizer(case, run_opts, ex,
+                                           initial_design, fvals)
     print('\nTime elapsed: ',datetime.now() - startTime)
     X = np.vstack(Xi)
     Y = np.hstack(Fi).T
@@ -54,6 +56,7 @@ def optimize_model(case, run_opts):
         print("{name} :".format(name=name), x_best[n])
 
     # Fit a tree model to get variable importance
+    import sklearn.ensemble as skl
     forest = skl.ExtraTreesRegressor()
     forest.fit(X, Y)
 
@@ -87,6 +90,8 @@ def proc_commandline():
                         help="number of points in initial design")
     parser.add_argument("-p", "--num_points", type=int,
                         help="number of points per iteration")
+    parser.add_argument("-a", "--asynchronous", action="store_true",
+                        help="evaluate points asynchronously")
     args = parser.parse_args()
     case, run_opts = read_config(args.fname)
     if args.num_jobs:
@@ -95,6 +100,8 @@ def proc_commandline():
         run_opts.max_iter = args.max_iter
     if args.num_initial:
         run_opts.num_initial = args.num_initials
+    if args.asynchronous:
+        run_opts.asynchronous = True
     return case, run_opts
 
 
@@ -105,6 +112,14 @@ def create_dirs(run_opts):
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "rescore":
+        from pyropython.rescore import main as rescore_main
+        rescore_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        from pyropython.remote import main as worker_main
+        worker_main(sys.argv[2:])
+        return
     case, run_opts = proc_commandline()
     case.print_info()
     create_dirs(run_opts)
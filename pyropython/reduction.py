@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.reduction: Reduction of experimental data to fewer points
+
+Experimental data is often recorded at a much higher rate than needed for
+comparison with simulations. The functions in this module reduce a data
+series (x, y) and its data weights w to fewer points. The objective function
+is then evaluated on the reduced series.
+"""
+
+import numpy as np
+
+
+def uniform_reduction(x, y, w, num_points=200, **kwargs):
+    """
+    Picks num_points evenly spaced (by index) samples, including the first
+    and the last sample.
+    """
+    n = len(x)
+    if n <= num_points:
+        return x, y, w
+    ind = np.unique(np.linspace(0, n - 1, num_points).round().astype(int))
+    return x[ind], y[ind], w[ind]
+
+
+def bin_reduction(x, y, w, num_points=200, **kwargs):
+    """
+    Divides the samples into num_points consecutive bins of equal size and
+    replaces each bin by the means of x, y and w in the bin.
+    """
+    n = len(x)
+    if n <= num_points:
+        return x, y, w
+    edges = np.linspace(0, n, num_points + 1).round().astype(int)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+
+    def mean(v):
+        return np.add.reduceat(v, starts)/counts
+    return mean(x), mean(y), mean(w)
+
+
+def adaptive_reduction(x, y, w, num_points=200, alpha=0.5, **kwargs):
+    """
+    Picks num_points samples, placing more points where the curvature of
+    the data is large. The density of points is proportional to
+
+        (1 - alpha)/n + alpha*abs(y'')/sum(abs(y''))
+
+    so that alpha=0 gives uniform_reduction. The curvature is computed from
+    the data, so noisy data should be filtered first.
+    """
+    n = len(x)
+    if n <= num_points:
+        return x, y, w
+    curvature = np.abs(np.gradient(np.gradient(y, x), x))
+    total = curvature.sum()
+    density = np.full(n, (1.0 - alpha)/n)
+    if total > 0:
+        density += alpha*curvature/total
+    else:
+        density += alpha/n
+    cumulative = np.cumsum(density)
+    targets = np.linspace(cumulative[0], cumulative[-1], num_points)
+    ind = np.searchsorted(cumulative, targets).clip(0, n - 1)
+    ind = np.unique(np.concatenate(([0], ind, [n - 1])))
+    return x[ind], y[ind], w[ind]
+
+
+def none_reduction(x, y, w, **kwargs):
+    return x, y, w
+
+
+reduction_types = {"uniform": uniform_reduction,
+                   "bin": bin_reduction,
+                   "adaptive": adaptive_reduction,
+                   "none": none_reduction
+                   }
+
+
+def get_reduction(name):
+    if name.lower() not in reduction_types:
+        raise ValueError("Unknown reduction type %s." % name.lower())
+    return reduction_types[name.lower()]
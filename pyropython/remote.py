@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.remote: Model evaluation in worker processes on other nodes
+
+The optimization runs in a driver process, which listens for connections from
+worker processes (see socket_pool()). The workers can run on any node that
+can connect to the driver. A worker receives the Model once, when it
+connects, and then runs the tasks sent by the driver, one at a time, e.g.
+workers.fitness(). The working directories are created in Model.tempdir, so
+it should be on a file system shared by all nodes. Otherwise the case
+directory must be copied to the same path on each node, and only the
+workers on the driver's node see the files the driver writes to
+Model.tempdir: the incumbent (Model.incumbent_file) and the median runtimes
+(Model.runtime_file). On the other nodes, early termination, the timeouts
+relative to the median runtime and backfilling of the cores are disabled,
+and the working directories of the best points are not kept.
+
+The messages are pickled and sent using multiprocessing.connection. The
+connections are authenticated using a shared key.
+
+Usage:
+    pyropython worker HOST:PORT [-n NUM_WORKERS] [--authkey KEY]
+
+The worker must be started in the case directory, where the templates are.
+"""
+
+import os
+import copy
+import time
+import queue
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Executor, Future
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+from pyropython.scheduler import CoreSlots
+
+# environment variable for the authentication key of the workers
+AUTHKEY_VAR = "PYROPYTHON_AUTHKEY"
+
+
+def parse_address(address):
+    """ Converts "host:port" to (host, port) """
+    if isinstance(address, str):
+        host, _, port = address.rpartition(":")
+        return host, int(port)
+    return tuple(address)
+
+
+def connect_address(address):
+    """ Address for connecting to a listener bound to address """
+    host, port = address
+    if host in ("", "0.0.0.0"):
+        host = "127.0.0.1"
+    return host, port
+
+
+class SocketExecutor(Executor):
+    """ Executor running the tasks in remote worker processes
+
+    Tasks are queued and sent to the first free worker. If the connection
+    to a worker is lost, its task is sent to another worker, at most
+    max_resubmits times. A task that keeps killing its workers then fails.
+
+    Args:
+        case (:Model): the model, sent to the workers when they connect
+        address (:tuple or string): (host, port) to listen on. Port 0 picks
+            a free port, see SocketExecutor.address.
+        authkey (:bytes): authentication key of the workers
+        max_resubmits (:int): how many times the task of a lost worker is
+            sent to another worker
+    """
+
+    def __init__(self, case, address=("127.0.0.1", 0), authkey=None,
+                 max_resubmits=2):
+        self.case = case
+        self.authkey = authkey
+        self.max_resubmits = max_resubmits
+        self._listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self._listener.address
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._handlers = []
+        self._closing = False
+        self._accepter = threading.Thread(target=self._accept, daemon=True)
+        self._accepter.start()
+
+    @property
+    def num_workers(self):
+        """ Number of connected workers """
+        with self._lock:
+            return len(self._handlers)
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                # failed authentication or closed listener
+                if self._closing:
+                    return
+                continue
+            if self._closing:
+                conn.close()
+                return
+            handler = threading.Thread(target=self._serve, args=(conn,),
+                                       daemon=True)
+            with self._lock:
+                self._handlers.append(handler)
+            handler.start()
+
+    def _serve(self, conn):
+        """ Sends tasks to the worker at the other end of conn """
+        try:
+            conn.send(("init", self.case))
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    conn.send(("stop",))
+                    break
+                future, fn, args, kwargs, resubmits = task
+                # resent tasks are already running
+                if not (future.running() or
+                        future.set_running_or_notify_cancel()):
+                    continue
+                try:
+                    conn.send(("task", fn, args, kwargs))
+                    status, result = conn.recv()
+                except (OSError, EOFError):
+                    if resubmits < self.max_resubmits:
+                        self._tasks.put((future, fn, args, kwargs,
+                                         resubmits + 1))
+                        print("WARNING: lost connection to a worker. "
+                              "Task resubmitted.")
+                    else:
+                        future.set_exception(RuntimeError(
+                            "Lost the connection to %d workers running the "
+                            "task" % (resubmits + 1)))
+                    break
+                if status == "ok":
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        except (OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                self._handlers.remove(threading.current_thread())
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closing:
+            raise RuntimeError("cannot schedule new tasks after shutdown")
+        future = Future()
+        self._tasks.put((future, fn, args, kwargs, 0))
+        return future
+
+    def shutdown(self, wait=True, **kwargs):
+        if self._closing:
+            return
+        self._closing = True
+        with self._lock:
+            handlers = list(self._handlers)
+        # the queued tasks are run before the workers are stopped
+        for handler in handlers:
+            self._tasks.put(None)
+        if wait:
+            for handler in handlers:
+                handler.join()
+        # wake up the accepting thread
+        try:
+            Client(connect_address(self.address),
+                   authkey=self.authkey).close()
+        except OSError:
+            pass
+        self._listener.close()
+
+
+def run_worker(address, authkey=None, wait=60.0, slots=None):
+    """ Connects to the driver at address and runs the tasks it sends,
+        until the driver stops the worker.
+
+    Args:
+        address (:tuple or string): (host, port) of the driver
+        authkey (:bytes): authentication key
+        wait (:float): time to wait for the driver to start, in seconds
+        slots (:CoreSlots, optional): free cores of this node, shared by
+            the workers of the node. See Model.slots.
+    """
+    from pyropython import workers
+    address = parse_address(address)
+    deadline = time.time() + wait
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(1.0)
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            if message[0] == "init":
+                case = message[1]
+                case.slots = slots
+                workers.set_case(case)
+            elif message[0] == "task":
+                fn, args, kwargs = message[1:]
+                try:
+                    result = ("ok", fn(*args, **kwargs))
+                except Exception as e:
+                    result = ("error", e)
+                conn.send(result)
+            else:
+                return
+
+
+def start_workers(address, num_workers, authkey=None, wait=60.0,
+                  slots=None):
+    """ Starts num_workers worker processes on this node, see run_worker()
+
+    Returns:
+        procs (:list): multiprocessing.Process objects
+    """
+    procs = [Process(target=run_worker, args=(address, authkey, wait, slots))
+             for n in range(num_workers)]
+    for proc in procs:
+        proc.start()
+    return procs
+
+
+@contextmanager
+def socket_pool(case, num_jobs, address=("127.0.0.1", 0), authkey=None,
+                local_workers=None, max_resubmits=2):
+    """ Starts a SocketExecutor for evaluating case in remote workers.
+
+    The functions in pyropython.workers can be submitted to the returned
+    executor, as with workers.worker_pool().
+
+    Args:
+        case (:Model): the model
+        num_jobs (:int): total number of concurrent evaluations. Should
+            equal the number of workers.
+        address (:tuple or string): address to listen on, e.g.
+            "0.0.0.0:6000" to accept workers from other nodes.
+        authkey (:string): authentication key of the workers. Defaults to
+            the environment variable PYROPYTHON_AUTHKEY, or a random key if
+            all workers are started on this node. The key is never printed,
+            since anyone knowing it can run code in the driver and workers.
+        local_workers (:int): number of workers started on this node.
+            Defaults to num_jobs if listening on a local address and to 0
+            otherwise.
+        max_resubmits (:int): see SocketExecutor
+
+    Yields:
+        executor (:SocketExecutor)
+    """
+    host, port = parse_address(address)
+    if local_workers is None:
+        local_workers = num_jobs if host in ("127.0.0.1", "localhost") else 0
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VAR)
+    if authkey is None:
+        if local_workers < num_jobs:
+            raise ValueError("Workers on other nodes need a shared "
+                             "authentication key. Set the environment "
+                             "variable %s or executor_opts.authkey."
+                             % AUTHKEY_VAR)
+        authkey = os.urandom(16).hex()
+    authkey = authkey.encode()
+    # the core slots are shared only by the workers of a node
+    remote_case = copy.copy(case)
+    remote_case.slots = None
+    ex = SocketExecutor(remote_case, address=address, authkey=authkey,
+                        max_resubmits=max_resubmits)
+    host, port = ex.address
+    if local_workers < num_jobs:
+        print("Waiting for %d workers at port %d. Start them with the same "
+              "%s as this process:" % (num_jobs - local_workers, port,
+                                       AUTHKEY_VAR))
+        print("    pyropython worker %s:%d" % (os.uname().nodename, port))
+    procs = start_workers(connect_address(ex.address), local_workers,
+                          authkey, slots=case.slots)
+    try:
+        with ex:
+            yield ex
+    finally:
+        for proc in procs:
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.terminate()
+
+
+def proc_commandline(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pyropython worker",
+        description="Evaluate models for an optimization running on "
+                    "another node")
+    parser.add_argument("address", help="HOST:PORT of the driver")
+    parser.add_argument("-n", "--num_workers", type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument("--authkey",
+                        help="authentication key, overrides the "
+                             "environment variable %s" % AUTHKEY_VAR)
+    parser.add_argument("--num_cores", type=int,
+                        help="number of cores shared by the simulations "
+                             "of the workers (default: all cores)")
+    parser.add_argument("--pin_cores", action="store_true",
+                        help="pin the simulations to their cores")
+    parser.add_argument("--wait", type=float, default=60.0,
+                        help="time to wait for the driver in seconds "
+                             "(default: 60)")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = proc_commandline(argv)
+    authkey = args.authkey or os.environ.get(AUTHKEY_VAR)
+    if authkey is None:
+        parser.error("authentication key not given. Use --authkey or set %s"
+                     % AUTHKEY_VAR)
+    procs = start_workers(args.address, args.num_workers, authkey.encode(),
+                          wait=args.wait, slots=CoreSlots(args.num_cores,
+                                          pin=args.pin_cores))
+    for proc in procs:
+        proc.join()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.resample: Interpolation of simulation data to experimental times
+
+Simulation output is usually written on the same time grid in every run.
+The Resampler computes the interpolation indices and weights from a
+simulation grid to an experimental grid once and reuses them as long as the
+grids do not change. The interpolation of all variables is done with a single
+gather over the concatenated simulation data.
+"""
+
+import numpy as np
+
+
+def interp_weights(x, xp):
+    """ Indices and weights for linear interpolation from xp to x
+
+    The result matches np.interp(x, xp, fp): values outside xp are set
+    to fp[0] and fp[-1].
+
+    Returns:
+        i0, i1 (:array): indices of the neighbouring points in xp
+        w (:array): weights, the interpolated value is
+            fp[i0] + w*(fp[i1]-fp[i0])
+    """
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    n = len(xp)
+    i0 = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, max(n - 2, 0))
+    i1 = np.minimum(i0 + 1, n - 1)
+    dx = xp[i1] - xp[i0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(dx > 0, (x - xp[i0])/dx, 0.0)
+    w = np.clip(w, 0.0, 1.0)
+    return i0, i1, w
+
+
+class Resampler:
+    """ Interpolates simulation data to experimental times
+
+    The interpolation indices and weights of all variables are cached and
+    recomputed only if the simulation or experimental times change. The cached
+    plan is replaced, never modified, so a Resampler can be shared by threads.
+    """
+
+    def __init__(self):
+        self._plan = None
+        self.num_updates = 0
+
+    @staticmethod
+    def _grids_equal(plan, keys, grids):
+        """ Checks whether plan is valid for the given grids """
+        if plan is None or plan["keys"] != keys:
+            return False
+        checked = {}
+        for (T, etime), (cT, cetime) in zip(grids, plan["grids"]):
+            if not (etime is cetime or np.array_equal(etime, cetime)):
+                return False
+            # data lines read from the same file share the time array
+            if id(T) not in checked:
+                checked[id(T)] = np.array_equal(T, cT)
+            if not checked[id(T)]:
+                return False
+        return True
+
+    def _make_plan(self, keys, grids):
+        i0 = []
+        i1 = []
+        w = []
+        slices = []
+        offset = 0
+        start = 0
+        for T, etime in grids:
+            k0, k1, wk = interp_weights(etime, T)
+            i0.append(k0 + offset)
+            i1.append(k1 + offset)
+            w.append(wk)
+            offset += len(T)
+            slices.append(slice(start, start + len(etime)))
+            start += len(etime)
+        plan = {"keys": keys,
+                "grids": [(np.array(T), etime) for T, etime in grids],
+                "i0": np.concatenate(i0),
+                "i1": np.concatenate(i1),
+                "w": np.concatenate(w),
+                "slices": slices}
+        self._plan = plan
+        self.num_updates += 1
+        return plan
+
+    def __call__(self, exp_data, data):
+        """ Interpolates data to the times of exp_data
+
+        Args:
+            exp_data (:dict): Dictionary, with entries key: (etime, edata)
+            data (:dict): Dictionary, with entries key: (T,F), as returned by
+                Model.read_output()
+
+        Returns:
+            resampled (:dict): Dictionary, with entries key: Fi, where Fi
+                is F interpolated to etime, for the keys found in both
+                exp_data and data.
+        """
+        keys, resampled, plan = self._resample(exp_data, data)
+        if not keys:
+            return {}
+        return {key: resampled[sl] for key, sl in zip(keys, plan["slices"])}
+
+    def concatenated(self, exp_data, data):
+        """ Same as Resampler.__call__(), but returns the interpolated data
+            of all variables concatenated.
+
+        Returns:
+            keys (:list): keys found in both exp_data and data, in the order
+                of exp_data
+            resampled (:array): interpolated data of the variables in keys
+        """
+        keys, resampled, plan = self._resample(exp_data, data)
+        return keys, resampled
+
+    def _resample(self, exp_data, data):
+        keys = [key for key in exp_data if key in data]
+        if not keys:
+            return keys, np.zeros(0), None
+        grids = [(data[key][0], exp_data[key][0]) for key in keys]
+        plan = self._plan
+        if not self._grids_equal(plan, keys, grids):
+            plan = self._make_plan(keys, grids)
+        F = np.concatenate([data[key][1] for key in keys]).astype(float,
+                                                                 copy=False)
+        # F[i0] + w*(F[i1]-F[i0]) for all variables at once
+        F0 = F.take(plan["i0"])
+        resampled = F.take(plan["i1"])
+        resampled -= F0
+        resampled *= plan["w"]
+        resampled += F0
+        return keys, resampled, plan
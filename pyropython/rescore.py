@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.rescore: Re-evaluate archived simulations with the current config
+
+The simulation data stored in the archive (see pyropython.archive) is scored
+against the experimental data, objective function and weights of the current
+config file. No simulations are run. The results are written to a csv file,
+ranked from best to worst, which can be used as the initial_design_file of a
+new optimization.
+
+Usage:
+    pyropython rescore config.yml [-a ARCHIVE_DIR] [-o OUTPUT] [-n NUM_BEST]
+
+Note that the archive stores the simulation data after processing. Changes to
+the processing options of the simulation data lines (filter_type, conversion
+factors, etc.) are not applied to archived data.
+"""
+
+import argparse
+from datetime import datetime
+import numpy as np
+from pyropython.archive import Archive
+
+
+def interpolate_chunk(chunk, key, etime):
+    """ Interpolates variable key of all evaluations in an ArchiveChunk
+
+    Returns:
+        S (:array): array of shape (len(chunk), len(etime)). Row n is the
+            simulation data of evaluation n interpolated to etime.
+    """
+    T, F, offsets = chunk.columns(key)
+    T = np.asarray(T, dtype=float)
+    F = np.asarray(F, dtype=float)
+    S = np.empty((len(chunk), len(etime)))
+    for n in range(len(chunk)):
+        start, end = offsets[n], offsets[n+1]
+        S[n] = np.interp(etime, T[start:end], F[start:end])
+    return S
+
+
+def rescore_chunk(case, chunk):
+    """ Evaluates the objective function of case for all evaluations in an
+        ArchiveChunk. Gives the same values as Model.objective() for the
+        archived data.
+
+    Returns:
+        fit (:array): objective values
+    """
+    fused = case.fused_objective
+    if fused is not None and all(key in chunk.keys for key in fused.keys):
+        S = np.hstack([interpolate_chunk(chunk, key, case.exp_data[key][0])
+                       for key in fused.keys])
+        return fused(S)
+    fit = np.zeros(len(chunk))
+    weight_sum = 0.0
+    for key, (etime, edata) in case.exp_data.items():
+        weight = case.var_weights[key]
+        weight_sum += weight
+        if key not in chunk.keys:
+            continue
+        S = interpolate_chunk(chunk, key, etime)
+        fit += weight*case.objective_function(edata, S,
+                                              case.data_weights[key],
+                                              **case.objective_opts)
+    return fit/weight_sum
+
+
+def rescore(case, archive):
+    """ Evaluates the objective function of case for all evaluations in
+        an Archive.
+
+    Returns:
+        X (:array): parameter vectors, in the order of case.params
+        f (:array): objective values
+    """
+    names = [name for name, bounds in case.params]
+    X = []
+    f = []
+    for chunk in archive.chunks():
+        x = np.asarray(chunk.x)
+        if chunk.params:
+            missing = [name for name in names if name not in chunk.params]
+            if missing:
+                raise ValueError("Parameters %s not found in archive chunk %s"
+                                 % (", ".join(missing), chunk.path))
+            x = x[:, [chunk.params.index(name) for name in names]]
+        X.append(x)
+        f.append(rescore_chunk(case, chunk))
+    if not X:
+        return np.zeros((0, len(names))), np.zeros(0)
+    return np.vstack(X), np.concatenate(f)
+
+
+def write_ranked(fname, params, X, f, num_best=None):
+    """ Writes the points sorted by objective value to a csv file
+
+    The file has columns Rank, the parameter names and Objective and can be
+    read with utils.read_initial_design().
+    """
+    ind = np.argsort(f, kind="stable")
+    if num_best is not None:
+        ind = ind[:num_best]
+    header = ",".join(["Rank"] + [name for name, bounds in params] +
+                      ["Objective"])
+    with open(fname, "w") as out:
+        out.write(header + "\n")
+        for rank, n in enumerate(ind):
+            line = (["%d" % (rank+1)] + ["%.10g" % v for v in X[n]] +
+                    ["%.10g" % f[n]])
+            out.write(",".join(line) + "\n")
+
+
+def proc_commandline(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pyropython rescore",
+        description="Re-evaluate archived simulations with the current "
+                    "config file")
+    parser.add_argument("fname", help="Input file name")
+    parser.add_argument("-a", "--archive_dir",
+                        help="archive directory, overrides archive_dir "
+                             "in the input file")
+    parser.add_argument("-o", "--output", default="rescored.csv",
+                        help="output file name (default: rescored.csv)")
+    parser.add_argument("-n", "--num_best", type=int,
+                        help="write only the num_best best points")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    from pyropython.config import read_config
+    parser, args = proc_commandline(argv)
+    case, run_opts = read_config(args.fname)
+    archive_dir = args.archive_dir or run_opts.archive_dir
+    if archive_dir is None:
+        parser.error("archive_dir not given in %s or on the command line" %
+                     args.fname)
+    startTime = datetime.now()
+    X, f = rescore(case, Archive(archive_dir))
+    if len(f) == 0:
+        print("No evaluations found in archive %s" % archive_dir)
+        return
+    write_ranked(args.output, case.params, X, f, num_best=args.num_best)
+    print("Re-scored %d evaluations in %s" % (len(f),
+                                              datetime.now() - startTime))
+    print("Results written to %s" % args.output)
+    n = np.argmin(f)
+    print("\nThe best result found was: %.3E" % f[n])
+    for i, (name, bounds) in enumerate(case.params):
+        print("{name} :".format(name=name), X[n, i])
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.runner: Launching and supervising simulator processes
+"""
+
+import os
+import time
+import subprocess
+from pyropython.scheduler import pinned
+
+
+class Simulation:
+    """ A single run of the simulator
+
+    The simulator is started in directory cwd as [command, fname], or with
+    the given command line args, and its standard output and error are
+    written to "<fname>_stdout.txt". cores is the number of cores used by
+    the simulation, see run_simulations(). If affinity is set, the
+    simulation is pinned to the given core ids. If timeout is set, the
+    simulation is killed after running timeout seconds. expected_runtime,
+    e.g. the median runtime of the template, is used for backfilling the
+    cores reserved for larger simulations.
+    """
+
+    def __init__(self, command, fname, cwd, env=None, args=None, cores=1,
+                 timeout=None, expected_runtime=None):
+        self.command = command
+        self.fname = fname
+        self.cwd = cwd
+        self.env = env
+        self.args = args or [command, fname]
+        self.cores = cores
+        # ids of the cores reserved from the CoreSlots of run_simulations()
+        self.reserved = []
+        # queued request for the cores, see CoreSlots.enqueue()
+        self.ticket = None
+        self.affinity = None
+        self.timeout = timeout
+        self.timed_out = False
+        self.expected_runtime = expected_runtime
+        self.proc = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        outname = os.path.join(self.cwd, "%s_stdout.txt" % self.fname)
+        with open(outname, "wb") as out, pinned(self.affinity):
+            self.proc = subprocess.Popen(self.args,
+                                         env=self.env,
+                                         cwd=self.cwd,
+                                         stderr=out,
+                                         stdout=out)
+        self.start_time = time.perf_counter()
+
+    def poll(self):
+        """ Returns the return code or None if still running """
+        if self.returncode is None:
+            self.returncode = self.proc.poll()
+            if self.returncode is not None:
+                self.end_time = time.perf_counter()
+        return self.returncode
+
+    def kill(self):
+        if self.proc is not None and self.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+            self.poll()
+
+    @property
+    def runtime(self):
+        """ Wall time of the simulation in seconds """
+        if self.start_time is None:
+            return 0.0
+        end = self.end_time or time.perf_counter()
+        return end - self.start_time
+
+
+def run_simulations(simulations,
+                    max_parallel=1,
+                    poll_interval=0.05,
+                    monitor=None,
+                    monitor_interval=10.0,
+                    slots=None):
+    """ Runs simulations concurrently
+
+    At most max_parallel simulations are running at the same time. The
+    simulations are started in the order given. If slots is given, a
+    simulation is started only when Simulation.cores cores are free, and
+    pinned to them if slots.pin is True. Simulations running longer than
+    Simulation.timeout are killed and marked with Simulation.timed_out.
+    Simulations that do not fit are queued in slots and skipped until cores
+    are released. Meanwhile, the free cores are filled by the smaller
+    simulations that do not delay the oldest queued one, see CoreSlots.
+
+    Args:
+        simulations (:list): list of Simulation objects
+        max_parallel (:int): maximum number of concurrent simulations. If
+            None, all simulations are started at once.
+        poll_interval (:float): time between checks for finished
+            simulations in seconds.
+        monitor (callable, optional): Called every monitor_interval seconds
+            while simulations are running. If it returns True, all running
+            simulations are killed and the remaining ones are not started.
+        monitor_interval (:float): time between calls to monitor in seconds.
+        slots (:CoreSlots, optional): free cores, shared with other
+            evaluations. See pyropython.scheduler.
+
+    Returns:
+        completed (:bool): False if the simulations were terminated by
+            the monitor, True otherwise. The return codes are stored in
+            Simulation.returncode.
+    """
+    pending = list(simulations)
+    running = []
+    if max_parallel is None or max_parallel < 1:
+        max_parallel = len(pending)
+    last_check = time.perf_counter()
+
+    def release(sim):
+        if sim.reserved:
+            slots.release(sim.reserved)
+            sim.reserved = []
+    try:
+        while pending or running:
+            for sim in list(pending):
+                if len(running) >= max_parallel:
+                    break
+                if slots is not None:
+                    sim.reserved = slots.try_acquire(
+                        sim.cores, ticket=sim.ticket,
+                        runtime=sim.expected_runtime)
+                    if not sim.reserved:
+                        if sim.ticket is None:
+                            sim.ticket = slots.enqueue(sim.cores)
+                        continue
+                    sim.ticket = None
+                    if slots.pin:
+                        sim.affinity = sim.reserved
+                pending.remove(sim)
+                running.append(sim)
+                sim.start()
+            for sim in running:
+                if sim.timeout is not None and sim.runtime > sim.timeout:
+                    sim.kill()
+                    sim.timed_out = True
+            finished = [sim for sim in running if sim.poll() is not None]
+            for sim in finished:
+                release(sim)
+                running.remove(sim)
+            if not running:
+                if pending and slots is not None:
+                    # waiting for cores used by other evaluations
+                    slots.wait(poll_interval)
+                continue
+            if (monitor is not None and
+                    time.perf_counter() - last_check > monitor_interval):
+                last_check = time.perf_counter()
+                if monitor():
+                    return False
+            time.sleep(poll_interval)
+    finally:
+        for sim in running:
+            sim.kill()
+            release(sim)
+        for sim in pending:
+            if sim.ticket is not None:
+                slots.cancel(sim.ticket)
+                sim.ticket = None
+    return True
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.sandbox: Reusable working directories for the simulations
+
+Creating and deleting a directory for every evaluation is a significant part
+of the cost of short simulations. A SandboxPool keeps the working
+directories of a process and reuses them: after an evaluation, the files
+written into a sandbox are removed and the sandbox is handed out again.
+Static input files are linked into each sandbox once, when it is created.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.util import Finalize, register_after_fork
+
+
+def link_file(src, dst):
+    """ Hard links src to dst, or makes a symbolic link if that fails
+        (e.g. across file systems).
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def remove_dirs(paths):
+    for path in list(paths):
+        shutil.rmtree(path, ignore_errors=True)
+    paths.clear()
+
+
+class SandboxPool:
+    """ Pool of reusable working directories
+
+    Args:
+        root (:string): Directory where the sandboxes are created. Can be on
+            a RAM-backed file system, such as /dev/shm. If None, the default
+            temporary directory is used.
+        static_files (:list): Files linked into every sandbox
+        prefix (:string): Prefix of the sandbox directory names
+    """
+
+    def __init__(self, root, static_files=(), prefix="Cone_"):
+        self.root = root
+        self.static_files = list(static_files)
+        self.prefix = prefix
+        self._init_state()
+        # forked worker processes must not share the free sandboxes
+        register_after_fork(self, SandboxPool._init_state)
+
+    def _init_state(self):
+        self._free = []
+        # sandboxes owned by the pool, deleted when the process exits
+        self._owned = set()
+        self._lock = threading.Lock()
+        # unlike atexit, also run in multiprocessing worker processes
+        Finalize(self, remove_dirs, args=(self._owned,), exitpriority=0)
+
+    def __getstate__(self):
+        # each process has its own sandboxes
+        return {"root": self.root,
+                "static_files": self.static_files,
+                "prefix": self.prefix}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _create(self):
+        if self.root is not None:
+            os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=self.prefix, dir=self.root)
+        for fname in self.static_files:
+            link_file(fname, os.path.join(path, os.path.basename(fname)))
+        with self._lock:
+            self._owned.add(path)
+        return path
+
+    def acquire(self):
+        """ Returns the path of a clean sandbox """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return self._create()
+
+    def release(self, path):
+        """ Removes the files written into sandbox path and returns it to
+            the pool.
+        """
+        static = {os.path.basename(fname) for fname in self.static_files}
+        try:
+            for entry in os.scandir(path):
+                if entry.name in static:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+        except OSError:
+            # don't reuse a sandbox that could not be cleaned
+            self.detach(path)
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        with self._lock:
+            self._free.append(path)
+
+    def detach(self, path):
+        """ Removes sandbox path from the pool. The caller takes over the
+            directory, e.g. to keep the results, and is responsible for
+            deleting it.
+        """
+        with self._lock:
+            self._owned.discard(path)
+        return path
+
+    def clear(self):
+        """ Deletes the free sandboxes """
+        with self._lock:
+            free = list(self._free)
+            self._free.clear()
+            self._owned.difference_update(free)
+        remove_dirs(free)
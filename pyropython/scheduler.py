@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.scheduler: Sharing the cores of a node between simulations
+
+Each template can request several cores, e.g. for MPI ranks or OpenMP
+threads (see Resources). The simulations of all concurrent evaluations take
+their cores from a common CoreSlots, so that the node is not
+oversubscribed. A simulation that does not fit into the free cores waits.
+The oldest waiting simulation is started first, and smaller simulations are
+started in the meantime only if they are expected to finish before it can
+start (backfilling). Optionally, the simulations are pinned to their cores,
+spread across the NUMA nodes.
+
+The RuntimeModel predicts the runtime of an evaluation from the parameters,
+so that the longest evaluations of a batch can be started first.
+"""
+
+import os
+import glob
+import time
+import shlex
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+
+
+def available_cores():
+    """ Number of cores this process may run on """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_cpulist(text):
+    """ Converts a Linux cpu list, e.g. "0-3,8-11", to a list of core ids """
+    cores = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def numa_nodes(root="/sys/devices/system/node"):
+    """ Core ids of the NUMA nodes of this machine, restricted to the cores
+        this process may run on.
+
+    Returns:
+        nodes (:list): list of lists of core ids, one list per NUMA node.
+            A single node with all available cores if the topology is not
+            known.
+    """
+    try:
+        allowed = os.sched_getaffinity(0)
+    except AttributeError:
+        return [list(range(available_cores()))]
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(root, "node[0-9]*", "cpulist")),
+                       key=lambda p: int(p.split("node")[-1].split(os.sep)[0])):
+        with open(path) as f:
+            cores = [n for n in parse_cpulist(f.read()) if n in allowed]
+        if cores:
+            nodes.append(cores)
+    if not nodes:
+        nodes = [sorted(allowed)]
+    return nodes
+
+
+@contextmanager
+def pinned(cores):
+    """ Restricts the calling thread to cores within the block. Processes
+        started in the block inherit the affinity. Other threads are not
+        affected.
+    """
+    if not cores:
+        yield
+        return
+    old = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cores)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, old)
+
+
+class CoreSlots:
+    """ Free cores of a node
+
+    The cores can be shared by threads, and by processes that inherit the
+    CoreSlots, e.g. the workers of a ProcessPoolExecutor. It cannot be
+    pickled otherwise.
+
+    The cores of a simulation are taken from a single NUMA node if possible,
+    the one with the most free cores. Concurrent simulations are therefore
+    spread across the NUMA nodes.
+
+    Requests that could not be served are queued with enqueue(). The oldest
+    one, the head of the queue, gets the next free cores. Other requests are
+    served before it only if they leave enough cores for the head, or if
+    their expected runtime ends before the reserved cores are expected to
+    be released. Requests without an expected runtime wait for the head.
+
+    Args:
+        num_cores (:int): number of cores. Defaults to available_cores().
+            The cores are taken from all NUMA nodes in turn.
+        pin (:bool): if True, the simulations are pinned to the reserved
+            cores. Requires that num_cores is at most available_cores().
+        nodes (:list, optional): core ids of the NUMA nodes. Defaults to
+            numa_nodes().
+        max_waiting (:int): maximum number of queued requests. Further
+            requests are not queued and have no priority.
+    """
+
+    def __init__(self, num_cores=None, pin=False, nodes=None,
+                 max_waiting=1024):
+        if nodes is None:
+            nodes = numa_nodes()
+        if num_cores is None:
+            num_cores = sum(len(node) for node in nodes)
+        if pin and num_cores > sum(len(node) for node in nodes):
+            raise ValueError("Cannot pin simulations to %d cores, only %d "
+                             "are available" %
+                             (num_cores, sum(len(node) for node in nodes)))
+        # take the cores from the nodes in turn
+        selected = [[] for node in nodes]
+        n = 0
+        while n < min(num_cores, sum(len(node) for node in nodes)):
+            for node, sel in zip(nodes, selected):
+                if len(sel) < len(node) and n < num_cores:
+                    sel.append(node[len(sel)])
+                    n += 1
+        self.nodes = [sel for sel in selected if sel]
+        if num_cores > n:
+            # more cores than available, not pinned
+            start = max(max(node) for node in nodes) + 1
+            self.nodes.append(list(range(start, start + num_cores - n)))
+        self.cores = [core for node in self.nodes for core in node]
+        self.num_cores = num_cores
+        self.pin = pin
+        self._free = multiprocessing.Array("b", [1]*num_cores, lock=False)
+        # expected time.time() when each core is released, inf if unknown
+        self._end = multiprocessing.Array("d", num_cores, lock=False)
+        # queued requests: ticket (0 for an empty entry) and cores
+        self._tickets = multiprocessing.Array("q", max_waiting, lock=False)
+        self._waiting = multiprocessing.Array("i", max_waiting, lock=False)
+        self._next_ticket = multiprocessing.Value("q", 1, lock=False)
+        self._cond = multiprocessing.Condition()
+
+    @property
+    def free(self):
+        """ Number of free cores """
+        with self._cond:
+            return sum(self._free)
+
+    def enqueue(self, cores):
+        """ Queues a request for cores that could not be served
+
+        Returns:
+            ticket (:int): pass to try_acquire() or cancel(). None if the
+                queue is full.
+        """
+        cores = max(1, min(cores, self.num_cores))
+        with self._cond:
+            for n, ticket in enumerate(self._tickets):
+                if ticket == 0:
+                    ticket = self._next_ticket.value
+                    self._next_ticket.value += 1
+                    self._tickets[n] = ticket
+                    self._waiting[n] = cores
+                    return ticket
+        return None
+
+    def cancel(self, ticket):
+        """ Removes a queued request """
+        if ticket is None:
+            return
+        with self._cond:
+            self._remove(ticket)
+            self._cond.notify_all()
+
+    def _remove(self, ticket):
+        for n, t in enumerate(self._tickets):
+            if t == ticket:
+                self._tickets[n] = 0
+
+    def _head(self, ticket):
+        """ Cores of the oldest queued request before ticket, or 0 """
+        head, cores = None, 0
+        for t, c in zip(self._tickets, self._waiting):
+            if t and (ticket is None or t < ticket) and (head is None or
+                                                         t < head):
+                head, cores = t, c
+        return cores
+
+    def _can_backfill(self, cores, runtime, head_cores, num_free):
+        """ True if cores can be taken without delaying the head """
+        if num_free - cores >= head_cores:
+            return True
+        if runtime is None or num_free >= head_cores:
+            return False
+        # when the head is expected to have enough free cores
+        ends = sorted(self._end[n] for n in range(self.num_cores)
+                      if not self._free[n])
+        shadow = ends[head_cores - num_free - 1]
+        return time.time() + runtime <= shadow
+
+    def try_acquire(self, cores, ticket=None, runtime=None):
+        """ Reserves cores if they are free and not reserved for an older
+            request
+
+        Requests for more than num_cores cores are reduced to num_cores, so
+        that they can be started on an idle node.
+
+        Args:
+            cores (:int): number of cores
+            ticket (:int, optional): ticket of a queued request, see
+                enqueue(). The request is removed from the queue if the
+                cores are reserved.
+            runtime (:float, optional): expected runtime in seconds
+
+        Returns:
+            ids (:list): ids of the reserved cores, empty if not enough cores
+                were free.
+        """
+        cores = max(1, min(cores, self.num_cores))
+        with self._cond:
+            free = []
+            start = 0
+            for node in self.nodes:
+                free.append([n for n in range(start, start + len(node))
+                             if self._free[n]])
+                start += len(node)
+            num_free = sum(len(f) for f in free)
+            if num_free < cores:
+                return []
+            head_cores = self._head(ticket)
+            if head_cores and not self._can_backfill(cores, runtime,
+                                                     head_cores, num_free):
+                return []
+            free.sort(key=len, reverse=True)
+            if len(free[0]) >= cores:
+                # the node with the most free cores
+                ind = free[0][:cores]
+            else:
+                ind = [n for f in free for n in f][:cores]
+            end = np.inf if runtime is None else time.time() + runtime
+            for n in ind:
+                self._free[n] = 0
+                self._end[n] = end
+            if ticket is not None:
+                self._remove(ticket)
+            return [self.cores[n] for n in ind]
+
+    def release(self, ids):
+        """ Returns cores reserved by try_acquire() """
+        with self._cond:
+            for core in ids:
+                self._free[self.cores.index(core)] = 1
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """ Waits until cores are released or timeout seconds have passed """
+        with self._cond:
+            self._cond.wait(timeout)
+
+
+class Resources:
+    """ Resources of the simulation of a template
+
+    Args:
+        ranks (:int): number of MPI processes
+        threads (:int): number of OpenMP threads per process
+    """
+
+    def __init__(self, ranks=1, threads=1):
+        self.ranks = int(ranks)
+        self.threads = int(threads)
+
+    def __repr__(self):
+        return "Resources(ranks=%d, threads=%d)" % (self.ranks, self.threads)
+
+    @property
+    def cores(self):
+        """ Number of cores used by the simulation """
+        return self.ranks*self.threads
+
+    def launch_args(self, launch_command, command, fname):
+        """ Command line of the simulation
+
+        Args:
+            launch_command (:string): template of the command line, e.g.
+                "mpiexec -n {ranks} {command} {fname}". The fields are
+                command, fname, ranks, threads and cores.
+            command (:string): the simulator executable
+            fname (:string): the input file
+
+        Returns:
+            args (:list): arguments for subprocess.Popen
+        """
+        fields = {"command": command,
+                  "fname": fname,
+                  "ranks": self.ranks,
+                  "threads": self.threads,
+                  "cores": self.cores}
+        return [arg.format(**fields) for arg in shlex.split(launch_command)]
+
+
+class RuntimeModel:
+    """ Predicts the runtime of the simulations from the parameters
+
+    For each template, the logarithm of the runtime is fitted as a linear
+    function of the parameters, scaled to [0, 1], by ridge regression. The
+    model is refitted when new runtimes have been added.
+
+    Args:
+        bounds (:list): bounds of the parameters, [(minval, maxval)]
+        ridge (:float): regularization of the slopes
+    """
+
+    def __init__(self, bounds, ridge=1e-2):
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        self.lower = bounds[:, 0]
+        self.scale = bounds[:, 1] - bounds[:, 0]
+        self.scale[self.scale == 0] = 1.0
+        self.ridge = ridge
+        # {template: (scaled parameters, log runtimes)}
+        self.samples = {}
+        self._coefs = None
+
+    def __len__(self):
+        return max((len(y) for X, y in self.samples.values()), default=0)
+
+    def _features(self, X):
+        X = (np.atleast_2d(np.asarray(X, dtype=float)) - self.lower)/self.scale
+        return np.hstack([np.ones((len(X), 1)), X])
+
+    def add(self, x, runtimes):
+        """ Adds the runtimes of an evaluation
+
+        Args:
+            x (list like): parameter vector
+            runtimes (:dict): runtime in seconds of each template,
+                {template: runtime}
+        """
+        for name, runtime in runtimes.items():
+            X, y = self.samples.setdefault(name, ([], []))
+            X.append(np.asarray(x, dtype=float))
+            y.append(np.log(max(runtime, 1e-3)))
+        self._coefs = None
+
+    def fit(self):
+        coefs = {}
+        for name, (X, y) in self.samples.items():
+            A = self._features(X)
+            # the intercept is not regularized
+            R = self.ridge*len(y)*np.eye(A.shape[1])
+            R[0, 0] = 0.0
+            coefs[name] = np.linalg.solve(A.T @ A + R, A.T @ np.asarray(y))
+        self._coefs = coefs
+
+    def predict(self, X):
+        """ Predicted runtime of the evaluations of points X
+
+        Returns:
+            runtime (:array): sum of the predicted runtimes of the
+                templates. Zero if no runtimes have been added.
+        """
+        if self._coefs is None:
+            self.fit()
+        A = self._features(X)
+        runtime = np.zeros(len(A))
+        for coef in self._coefs.values():
+            runtime += np.exp(A @ coef)
+        return runtime
+
+    def medians(self):
+        """ Median runtime of each template
+
+        Returns:
+            medians (:dict): {template: (median runtime, number of runs)}
+        """
+        return {name: (float(np.exp(np.median(y))), len(y))
+                for name, (X, y) in self.samples.items()}
+
+    def order(self, X):
+        """ Indices of the points X, longest predicted runtime first. Points
+            with equal predictions are kept in the given order.
+        """
+        if len(X) == 0:
+            return []
+        return list(np.argsort(-self.predict(X), kind="stable"))
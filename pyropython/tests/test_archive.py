@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from pyropython.archive import Archive
+
+
+def make_data(n, length):
+    T = np.linspace(0, 1, length)
+    return {"A": (T, n*T), "B": (T[:length//2], np.full(length//2, n))}
+
+
+def test_chunks(tmp_path):
+    """ Evaluations are written in chunks and read back in order """
+    archive_dir = str(tmp_path / "Archive")
+    archive = Archive(archive_dir, params=[("x", (0, 1)), ("y", (0, 1))],
+                      chunk_size=4)
+    for n in range(10):
+        archive.append(float(n), [n, 2*n], make_data(n, 10 + n))
+    assert len(archive.chunks()) == 2
+    assert len(archive) == 10
+    archive.flush()
+    assert len(archive.chunks()) == 3
+    chunk = archive.chunks()[0]
+    assert isinstance(chunk.x, np.memmap)
+    assert chunk.params == ["x", "y"]
+    for n, (f, x, data) in enumerate(archive):
+        assert f == n
+        assert np.allclose(x, [n, 2*n])
+        assert len(data["A"][0]) == 10 + n
+        assert np.allclose(data["A"][1], n*np.linspace(0, 1, 10 + n))
+        assert np.allclose(data["B"][1], n)
+
+
+def test_reopen(tmp_path):
+    """ Reopening an archive appends new chunks after the old ones """
+    archive_dir = str(tmp_path / "Archive")
+    archive = Archive(archive_dir)
+    archive.append(1.0, [1.0], make_data(1, 10))
+    archive.flush()
+    archive = Archive(archive_dir)
+    archive.append(2.0, [2.0], make_data(2, 10))
+    # evaluations with different variables go into separate chunks
+    archive.append(3.0, [3.0], {"C": (np.zeros(3), np.ones(3))})
+    archive.flush()
+    assert sorted(os.listdir(archive_dir)) == ["chunk_000000",
+                                               "chunk_000001",
+                                               "chunk_000002"]
+    assert [f for f, x, data in archive] == [1.0, 2.0, 3.0]
+
+
+def test_flush_interval(tmp_path, monkeypatch):
+    """ Evaluations kept longer than flush_interval are written without
+        flush(), e.g. before the run is killed
+    """
+    import pyropython.archive
+    now = [100.0]
+    monkeypatch.setattr(pyropython.archive.time, "monotonic", lambda: now[0])
+    archive_dir = str(tmp_path / "Archive")
+    archive = Archive(archive_dir, flush_interval=60.0)
+    archive.append(1.0, [1.0], make_data(1, 10))
+    now[0] += 30.0
+    archive.append(2.0, [2.0], make_data(2, 10))
+    archive.flush_due()
+    assert len(Archive(archive_dir)) == 0
+    now[0] += 30.0
+    archive.flush_due()
+    assert [f for f, x, data in Archive(archive_dir)] == [1.0, 2.0]
+    # the interval starts again with the next evaluation
+    archive.append(3.0, [3.0], make_data(3, 10))
+    now[0] += 59.0
+    archive.append(4.0, [4.0], make_data(4, 10))
+    assert len(Archive(archive_dir)) == 2
+    now[0] += 1.0
+    archive.append(5.0, [5.0], make_data(5, 10))
+    assert len(Archive(archive_dir)) == 5
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import numpy as np
+from pyropython.cache import ResultCache
+
+
+def make_data(n=100):
+    T = np.linspace(0, 1, n)
+    return {"A": (T, T**2), "B": (T, np.sin(T))}
+
+
+def test_key(tmp_path):
+    """ Keys should change when inputs, command or data lines change """
+    cache = ResultCache(cache_dir=str(tmp_path))
+    simulation = {"A": {"fname": "out.csv", "dep_col_name": "A"}}
+    k1 = cache.key({"a.fds": "x=1"}, "fds", simulation)
+    k2 = cache.key({"a.fds": "x=2"}, "fds", simulation)
+    k3 = cache.key({"a.fds": "x=1"}, "fds_mpi", simulation)
+    k4 = cache.key({"a.fds": "x=1"}, "fds",
+                   {"A": {"fname": "out.csv", "dep_col_name": "B"}})
+    assert len({k1, k2, k3, k4}) == 4
+    assert k1 == cache.key({"a.fds": "x=1"}, "fds", simulation)
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path))
+    data = make_data()
+    assert cache.get("abcdef") is None
+    cache.put("abcdef", data)
+    cached = cache.get("abcdef")
+    assert set(cached) == set(data)
+    for key, (T, F) in data.items():
+        assert np.array_equal(cached[key][0], T)
+        assert np.array_equal(cached[key][1], F)
+
+
+def test_evict(tmp_path):
+    """ Old entries should be removed first """
+    cache = ResultCache(cache_dir=str(tmp_path), max_age=1.0)
+    data = make_data(1000)
+    for n in range(5):
+        cache.put("%02d" % n, data)
+    # make the first entry two days old
+    old = time.time() - 2*86400
+    os.utime(cache._path("00"), (old, old))
+    assert cache.evict() == 1
+    assert cache.get("00") is None
+    # limit size to roughly two entries
+    cache.max_size = 2.5*os.path.getsize(cache._path("01"))/1e6
+    assert cache.evict() == 2
+    assert cache.get("01") is None
+    assert cache.get("02") is None
+    assert cache.get("04") is not None
+
+
+def test_data_cache(tmp_path, monkeypatch):
+    """ Processed data is read from the cache until the file, the options or
+        the processing code change.
+    """
+    import pyropython.utils
+    from pyropython.cache import DataCache
+    calls = []
+    read_data = pyropython.utils.read_data
+
+    def counting_read_data(**line):
+        calls.append(line)
+        return read_data(**line)
+    monkeypatch.setattr(pyropython.utils, "read_data", counting_read_data)
+    fname = tmp_path / "exp.csv"
+    fname.write_text("Time,Y\n0,1\n1,3\n2,2\n")
+    cache = DataCache(cache_dir=str(tmp_path / "DataCache"))
+    line = {"fname": "exp.csv", "dep_col_name": "Y", "ind_col_name": "Time",
+            "header": 0,
+            "cwd": str(tmp_path)}
+    T1, F1 = cache.read_data(**line)
+    T2, F2 = cache.read_data(**line)
+    assert len(calls) == 1
+    assert np.allclose(T1, T2) and np.allclose(F1, F2)
+    cache.read_data(normalize=True, **line)
+    assert len(calls) == 2
+    fname.write_text("Time,Y\n0,1\n1,4\n2,2\n")
+    T3, F3 = cache.read_data(**line)
+    assert len(calls) == 3
+    assert F3[1] == 4
+    # changes to the processing code invalidate the entries
+    import pyropython.cache
+    cache.read_data(**line)
+    assert len(calls) == 3
+    monkeypatch.setattr(pyropython.cache, "_processing_digest", "changed")
+    cache.read_data(**line)
+    assert len(calls) == 4
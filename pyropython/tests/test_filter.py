@@ -23,3 +23,19 @@ def test_filters():
     # almost certainly we could use tighter tolerances
     for name in result:
         assert np.allclose(result[name], y, atol=20)
+
+
+def test_local_gp_filter():
+    """ Short series are filtered with the exact gp filter, long series
+        in blocks
+    """
+    from pyropython.filter import gp_filter, local_gp_filter
+    Time = np.linspace(0, 1800, num=1200)
+    y = 50 - 50 * np.tanh((Time-600)/100) + 5*np.sin(Time/40)
+    rng = np.random.RandomState(0)
+    ny = y + 5*rng.randn(len(Time))
+    short = slice(0, 1200, 10)
+    assert np.allclose(local_gp_filter(Time[short], ny[short]),
+                       gp_filter(Time[short], ny[short]))
+    ybar = local_gp_filter(Time, ny, subsample=300, block_size=200)
+    assert np.sqrt(np.mean((ybar - y)**2)) < 2.5
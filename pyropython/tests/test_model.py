@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import shutil
 import numpy as np
 from pyropython.config import _set_data_line_defaults
@@ -114,3 +115,347 @@ class TestClass:
         if os.path.exists(tempdir):
             shutil.rmtree(tempdir, ignore_errors=True)
             pass
+
+
+"""Tests below use a simple linear model, y = a*x + b, rendered into a python
+   script that writes its output in the FDS .csv layout.
+"""
+linear_template = """
+import numpy as np
+
+x = np.linspace(0, 100, 101)
+y = {{a}}*x + {{b}}
+
+f = open("output.csv", "w")
+f.write("s,-\\n")
+f.write("Time,Y\\n")
+for n in range(len(x)):
+    f.write("%.3f,%.10e\\n" % (x[n], y[n]))
+f.close()
+"""
+
+# Same as above, but writes the output slowly like a running simulation
+slow_linear_template = linear_template.replace(
+    "(x[n], y[n]))",
+    "(x[n], y[n]))\n    f.flush()\n    time.sleep(0.02)").replace(
+    "import numpy as np", "import time\nimport numpy as np")
+
+
+def make_linear_case(path, template=linear_template, **kwargs):
+    """ Create a Model for the linear test case in directory path"""
+    from pyropython.model import Model
+    with open(os.path.join(path, "linear.py"), "w") as f:
+        f.write(template)
+    workdir = os.path.join(path, "Work")
+    os.makedirs(workdir, exist_ok=True)
+    x = np.linspace(0, 100, 101)
+    y = 2*x + 1
+    simulation = {"Y": _set_data_line_defaults({"fname": "output.csv",
+                                                "dep_col_name": "Y"})}
+    return Model(exp_data={"Y": (x, y)},
+                 params=[("a", [0, 4]), ("b", [0, 2])],
+                 simulation=simulation,
+                 var_weights={"Y": 1},
+                 data_weights={"Y": np.ones_like(y)},
+                 templates=["linear.py"],
+                 command=sys.executable,
+                 tempdir=workdir,
+                 objective_function=get_objective_function("mse"),
+                 **kwargs)
+
+
+def test_result_cache(tmp_path, monkeypatch):
+    """ The second evaluation of the same point should come from the cache
+    """
+    from pyropython.cache import ResultCache
+    from queue import Queue
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(cache_dir=str(tmp_path / "Cache"))
+    case = make_linear_case(str(tmp_path), cache=cache)
+    queue = Queue()
+    f1 = case.fitness([2, 1], queue=queue)
+    f2 = case.fitness([2, 1], queue=queue)
+    f3 = case.fitness([1, 1], queue=queue)
+    stats = [queue.get()[3] for n in range(3)]
+    assert all(s.pop("wall_time") > 0 for s in stats)
+    # the simulations that were run report their runtime
+    assert stats[0].pop("runtime:linear.py") > 0
+    assert stats[2].pop("runtime:linear.py") > 0
+    assert f1 < tol
+    assert f1 == f2
+    assert f3 > f1
+    assert stats[0] == {"cache_misses": 1}
+    assert stats[1] == {"cache_hits": 1}
+    assert stats[2] == {"cache_misses": 1}
+
+
+def test_best_dir_cache_hit(tmp_path, monkeypatch):
+    """ Re-evaluating the best point from the cache keeps its output in the
+        best directory
+    """
+    from pyropython.cache import ResultCache
+    from pyropython.optimizer import Logger
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(cache_dir=str(tmp_path / "Cache"))
+    case = make_linear_case(str(tmp_path), cache=cache)
+    best_dir = tmp_path / "Best"
+    with Logger(params=case.params,
+                logfile=str(tmp_path / "log.csv"),
+                best_dir=str(best_dir),
+                incumbent_file=case.incumbent_file) as log:
+        for x in ([2, 1], [3, 1], [2, 1]):
+            case.fitness(x, queue=log.queue)
+            log()
+    assert sorted(os.listdir(str(best_dir))) == \
+        ["linear.py", "linear.py_stdout.txt", "output.csv"]
+    assert log.stats["cache_hits"] == 1
+    # the sandbox of the cache hit was wiped for reuse
+    sandboxes = [name for name in os.listdir(case.tempdir)
+                 if name.startswith("Cone_")]
+    assert len(sandboxes) == 1
+    assert os.listdir(os.path.join(case.tempdir, sandboxes[0])) == []
+
+
+def test_case_files(tmp_path, monkeypatch):
+    """ Cases sharing a working directory keep their own incumbent and
+        runtime files
+    """
+    from pyropython.optimizer import Logger
+    monkeypatch.chdir(tmp_path)
+    cases = [make_linear_case(str(tmp_path), casename=name)
+             for name in ("a", "b")]
+    assert cases[0].incumbent_file != cases[1].incumbent_file
+    assert cases[0].runtime_file != cases[1].runtime_file
+    logs = []
+    for case, name, x in zip(cases, "ab", ([2, 1], [3, 1])):
+        log = Logger(params=case.params,
+                     logfile=str(tmp_path / (name + ".csv")),
+                     incumbent_file=case.incumbent_file,
+                     runtime_file=case.runtime_file)
+        case.fitness(x, queue=log.queue)
+        log()
+        logs.append(log)
+    for case, log in zip(cases, logs):
+        with open(case.incumbent_file) as f:
+            assert float(f.read()) == log.f_best
+        assert os.path.exists(case.runtime_file)
+
+
+def test_early_termination(tmp_path, monkeypatch):
+    """ A bad point should be terminated once the incumbent is known
+    """
+    from queue import Queue
+    monkeypatch.chdir(tmp_path)
+    case = make_linear_case(str(tmp_path),
+                            template=slow_linear_template,
+                            early_termination={"factor": 2.0,
+                                               "interval": 0.2})
+    queue = Queue()
+    # without incumbent the simulation runs to the end
+    f1 = case.fitness([3, 1], queue=queue)
+    assert sorted(queue.get()[3]) == ["runtime:linear.py", "wall_time"]
+    with open(case.incumbent_file, "w") as f:
+        f.write("0.01")
+    f2 = case.fitness([3, 1], queue=queue)
+    fi, xi, pwd, stats, data = queue.get()
+    assert stats.pop("wall_time") > 0
+    assert stats == {"early_terminations": 1}
+    # the lower bound is below the real value, but above the threshold
+    assert 0.02 < f2 < f1
+
+
+def test_read_output_once(tmp_path, monkeypatch):
+    """ Data lines sharing an output file should read it only once
+    """
+    import pyropython.model as model
+    from pyropython.utils import read_data
+    case = make_linear_case(str(tmp_path))
+    case.simulation["G"] = _set_data_line_defaults({"fname": "output.csv",
+                                                    "dep_col_name": "Y",
+                                                    "gradient": True,
+                                                    "normalize": True})
+    monkeypatch.chdir(tmp_path)
+    data, pwd, stats = case.run_simulator([2, 1])
+    calls = []
+    read_columns = model.read_columns
+
+    def counting_read_columns(fname, **kwargs):
+        calls.append(fname)
+        return read_columns(fname, **kwargs)
+    monkeypatch.setattr(model, "read_columns", counting_read_columns)
+    data = case.read_output(cwd=pwd)
+    assert calls == ["output.csv"]
+    for key, line in case.simulation.items():
+        T, F = read_data(**line, cwd=pwd)
+        assert np.allclose(data[key][0], T)
+        assert np.allclose(data[key][1], F)
+
+
+def test_objective_batch(tmp_path):
+    """ The fused and batch objectives should match the loop over variables
+    """
+    case = make_linear_case(str(tmp_path))
+    assert case.fused_objective is not None
+    T = np.linspace(0, 100, 51)
+    data_list = [{"Y": (T, a*T + 1)} for a in [1.0, 2.0, 2.5]]
+    expected = [case.objective_function(case.exp_data["Y"][1],
+                                        np.interp(case.exp_data["Y"][0], T, F),
+                                        case.data_weights["Y"])
+                for T, F in (data["Y"] for data in data_list)]
+    assert np.allclose([case.objective(data) for data in data_list], expected)
+    assert np.allclose(case.objective_batch(data_list), expected)
+    # variables missing from the data
+    assert np.allclose(case.objective_batch([{}]), [0])
+
+
+def test_template_cache(tmp_path):
+    """ Templates are compiled once and again after they are modified, and
+        rendered to file
+    """
+    import hashlib
+    from pyropython.model import get_template
+    case = make_linear_case(str(tmp_path))
+    t1 = get_template("linear.py", root=str(tmp_path))
+    assert get_template("linear.py", root=str(tmp_path)) is t1
+    outname = str(tmp_path / "out.py")
+    digest = case.render_template(outname, t1, [2, 1])
+    text = (tmp_path / "out.py").read_text()
+    assert text == t1.render(a=2, b=1)
+    assert digest == hashlib.sha256(text.encode()).hexdigest()
+    (tmp_path / "linear.py").write_text("a={{a}}")
+    st = os.stat(str(tmp_path / "linear.py"))
+    os.utime(str(tmp_path / "linear.py"),
+             ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    t2 = get_template("linear.py", root=str(tmp_path))
+    assert t2 is not t1
+    assert t2.render(a=3) == "a=3"
+
+
+def test_sandbox_reuse(tmp_path, monkeypatch):
+    """ Working directories of points worse than the incumbent are reused,
+        others are handed over with the results
+    """
+    from queue import Queue
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static.txt").write_text("static")
+    case = make_linear_case(str(tmp_path),
+                            static_files=[str(tmp_path / "static.txt")])
+    with open(case.incumbent_file, "w") as f:
+        f.write("0.5")
+    queue = Queue()
+    case.fitness([3, 1], queue=queue)
+    case.fitness([1, 1], queue=queue)
+    assert queue.get()[2] is None
+    assert queue.get()[2] is None
+    sandboxes = [name for name in os.listdir(case.tempdir)
+                 if name.startswith("Cone_")]
+    assert len(sandboxes) == 1
+    assert sorted(os.listdir(os.path.join(case.tempdir, sandboxes[0]))) == \
+        ["static.txt"]
+    f = case.fitness([2, 1], queue=queue)
+    fi, xi, pwd, stats, data = queue.get()
+    assert f < tol
+    assert pwd == os.path.join(case.tempdir, sandboxes[0])
+    assert os.path.isfile(os.path.join(pwd, "output.csv"))
+
+
+def test_timeout(tmp_path, monkeypatch):
+    """ Simulations exceeding the time limit are killed and the evaluation
+        gets the penalty
+    """
+    import json
+    from queue import Queue
+    monkeypatch.chdir(tmp_path)
+    case = make_linear_case(str(tmp_path),
+                            template=slow_linear_template,
+                            timeout={"max_time": 60.0, "factor": 0.1,
+                                     "min_samples": 2, "penalty": 10.0,
+                                     "retries": 1})
+    # too few runs for a relative limit
+    with open(case.runtime_file, "w") as f:
+        json.dump({"linear.py": [1.0, 1]}, f)
+    assert case.simulation_timeout("linear.py", case.read_runtimes()) == 60.0
+    with open(case.runtime_file, "w") as f:
+        json.dump({"linear.py": [2.0, 5]}, f)
+    assert case.simulation_timeout("linear.py", case.read_runtimes()) == 0.2
+    queue = Queue()
+
+    def objective(data, partial=False):
+        raise AssertionError("objective of a killed simulation")
+    monkeypatch.setattr(case, "objective", objective)
+    f = case.fitness([2, 1], queue=queue)
+    fi, xi, pwd, stats, data = queue.get()
+    assert f == fi == 10.0
+    assert stats.pop("wall_time") > 0
+    # timeouts are not retried by default
+    assert stats == {"timeouts": 1}
+    case.timeout["retry_timeouts"] = True
+    case.fitness([2, 1], queue=queue)
+    stats = queue.get()[3]
+    stats.pop("wall_time")
+    assert stats == {"timeouts": 1, "retries": 1}
+
+
+def test_failure_retries(tmp_path, monkeypatch):
+    """ Failed simulations are run again, the ones failing every time give
+        the penalty and are not cached
+    """
+    from queue import Queue
+    from pyropython.cache import ResultCache
+    monkeypatch.chdir(tmp_path)
+    # fails on the first run in each working directory
+    flaky_template = linear_template.replace(
+        "import numpy as np",
+        "import os, sys\nimport numpy as np\n"
+        "if not os.path.exists('ran'):\n"
+        "    open('ran', 'w').close()\n"
+        "    sys.exit(1)")
+    cache = ResultCache(cache_dir=str(tmp_path / "Cache"))
+    case = make_linear_case(str(tmp_path), template=flaky_template,
+                            cache=cache,
+                            timeout={"penalty": 10.0, "retries": 1})
+    queue = Queue()
+    f = case.fitness([2, 1], queue=queue)
+    stats = queue.get()[3]
+    assert f < tol
+    assert stats["retries"] == 1
+    assert stats["runtime:linear.py"] > 0
+    assert "failures" not in stats
+    # fails every time
+    case.timeout["retries"] = 0
+    f = case.fitness([3, 1], queue=queue)
+    stats = queue.get()[3]
+    assert f == 10.0
+    assert stats["failures"] == 1
+    assert not any(name.startswith("runtime:") for name in stats)
+    case.timeout["retries"] = 1
+    case.fitness([3, 1], queue=queue)
+    assert queue.get()[3]["cache_misses"] == 1
+
+
+def test_template_include(tmp_path, monkeypatch):
+    """ Included templates are compiled once and again after they are
+        modified
+    """
+    from jinja2 import Environment
+    from pyropython.model import get_template
+    compiled = []
+    compile = Environment.compile
+
+    def counting_compile(self, source, name=None, *args, **kwargs):
+        compiled.append(name)
+        return compile(self, source, name, *args, **kwargs)
+    monkeypatch.setattr(Environment, "compile", counting_compile)
+    (tmp_path / "base.txt").write_text("b={{b}}")
+    (tmp_path / "main.txt").write_text("a={{a}}\n{% include 'base.txt' %}")
+    for n in range(3):
+        template = get_template("main.txt", root=str(tmp_path))
+        assert template.render(a=1, b=n) == "a=1\nb=%d" % n
+    assert sorted(compiled) == ["base.txt", "main.txt"]
+    (tmp_path / "base.txt").write_text("c={{b}}")
+    st = os.stat(str(tmp_path / "base.txt"))
+    os.utime(str(tmp_path / "base.txt"),
+             ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    template = get_template("main.txt", root=str(tmp_path))
+    assert template.render(a=1, b=2) == "a=1\nc=2"
+    assert sorted(compiled) == ["base.txt", "base.txt", "main.txt"]
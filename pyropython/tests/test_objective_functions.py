@@ -35,5 +35,32 @@ def test_standardized_moment():
     assert np.abs(mom2 - 1) < tol
 
 
+def test_fused_objective():
+    """ The fused objective should agree with the weighted sum of the
+        objective functions, also for a batch of simulations.
+    """
+    from pyropython.objective_functions import FusedObjective, fused_forms
+    rng = np.random.RandomState(1)
+    exp_data = {"A": (None, rng.rand(50) + 1.0),
+                "B": (None, rng.rand(20) + 2.0)}
+    data_weights = {"A": rng.rand(50), "B": np.ones(20)}
+    var_weights = {"A": 1.0, "B": 3.0}
+    sdata = {key: rng.rand(5, len(edata))
+             for key, (etime, edata) in exp_data.items()}
+    S = np.hstack([sdata["A"], sdata["B"]])
+    for of, opts in [(get_objective_function("mse"), {}),
+                     (get_objective_function("abs-dev"), {}),
+                     (get_objective_function("rel-err"), {"eps": 0.01}),
+                     (get_objective_function("standardized_moment"),
+                      {"p": 3})]:
+        assert of in fused_forms
+        fused = FusedObjective(of, exp_data, var_weights, data_weights, opts)
+        expected = sum(var_weights[key]*of(edata, sdata[key],
+                                           data_weights[key], **opts)
+                       for key, (etime, edata) in exp_data.items())/4.0
+        assert np.allclose(fused(S), expected)
+        assert np.isclose(fused(S[2]), expected[2])
+
+
 if __name__ == "__main__":
     test_standardized_moment()
@@ -1,3 +1,266 @@
 from pyropython.optimizer import (get_optimizer,
-                                  optimizers)
+                                  optimizers,
+                                  evaluate_async,
+                                  ask_pending,
+                                  map_longest_first,
+                                  Logger)
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
+from collections import namedtuple
+import time
 import numpy as np
+
+
+def test_evaluate_async(tmp_path):
+    """ All evaluations should be told to the optimizer, and the number of
+        running evaluations should never exceed num_jobs.
+    """
+    runopts = namedtuple("runopts", ["num_jobs", "num_points"])(3, 4)
+    running = []
+    told = []
+
+    def fun(x):
+        running.append(x)
+        assert len(running) <= runopts.num_jobs
+        time.sleep(0.01*x[0])
+        running.remove(x)
+        return [(x[0]**2, x, None, {}, None)], time.time()
+
+    asked = iter([[n] for n in range(5, 100)])
+    log = Logger(params=[("x", (0, 100))],
+                 logfile=str(tmp_path / "log.csv"))
+    with ThreadPoolExecutor(runopts.num_jobs) as ex:
+        evaluate_async(ex, fun, [[1], [4], [2]],
+                       ask=lambda n, pending: [next(asked) for i in range(n)],
+                       tell=lambda xi, yi: told.append((xi, yi)),
+                       num_evals=10,
+                       runopts=runopts,
+                       log=log)
+    assert len(told) == 10
+    assert all(yi == xi[0]**2 for xi, yi in told)
+    assert sorted(xi[0] for xi, yi in told) == [1, 2, 4] + list(range(5, 12))
+    # the shortest evaluation finishes first
+    assert told[0][0] == [1]
+    assert [len(f) for f in log.Fi] == [4, 4, 2]
+    assert log.f_best == 1
+    assert log.stats["ipc_messages"] == 10
+
+
+class ImmediateExecutor(Executor):
+    """ Runs the tasks when they are submitted, so that all of them have
+        finished at the next wait()
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+def test_evaluate_async_batch(tmp_path):
+    """ Several evaluations finishing together are replaced by distinct
+        points, chosen knowing the running ones.
+    """
+    import pytest
+    skopt = pytest.importorskip("skopt")
+    runopts = namedtuple("runopts", ["num_jobs", "num_points"])(3, 3)
+    optimizer = skopt.Optimizer([(0.0, 10.0), (0.0, 10.0)],
+                                n_initial_points=4, random_state=0)
+    asked = []
+
+    def ask(n, pending):
+        asked.append((n, len(pending)))
+        return ask_pending(optimizer, n, pending)
+
+    def fun(x):
+        return [((x[0] - 3)**2 + (x[1] - 7)**2, x, None, {}, None)], time.time()
+
+    log = Logger(params=[("x", (0, 10)), ("y", (0, 10))],
+                 logfile=str(tmp_path / "log.csv"))
+    evaluate_async(ImmediateExecutor(), fun, [[5.0, 5.0]],
+                   ask=ask,
+                   tell=optimizer.tell,
+                   num_evals=12,
+                   runopts=runopts,
+                   log=log)
+    # the free jobs are filled with one call
+    assert asked == [(2, 1), (3, 0), (3, 0), (3, 0)]
+    points = [tuple(x) for x in optimizer.Xi]
+    assert len(points) == 12
+    assert len(set(points)) == 12
+
+
+def test_ask_pending():
+    """ Points are not asked on top of the pending ones """
+    import pytest
+    skopt = pytest.importorskip("skopt")
+    optimizer = skopt.Optimizer([(0.0, 10.0)], n_initial_points=3,
+                                acq_optimizer="sampling", random_state=0)
+    optimizer.tell([[1.0], [5.0], [9.0]], [1.0, 0.5, 2.0])
+    x = optimizer.ask()
+    assert optimizer.ask() == x
+    new = ask_pending(optimizer, 2, [x])
+    assert len(new) == 2
+    assert all(np.abs(xi[0] - x[0]) > 1e-3 for xi in new)
+    assert len(optimizer.Xi) == 3
+
+
+def test_logger_add(tmp_path):
+    """ Results from the workers are added to the queue """
+    log = Logger(params=[("x", (0, 1)), ("y", (0, 1))],
+                 logfile=str(tmp_path / "log.csv"))
+    records = [(3.0, [0.1, 0.2], None, {"cache_hits": 1}, None),
+               (2.0, [0.3, 0.4], None, {"cache_misses": 1}, None)]
+    assert log.add((records, time.time() - 0.5)) == [3.0, 2.0]
+    log()
+    assert log.f_best == 2.0
+    assert log.stats["ipc_time"] >= 0.5
+    assert log.stats["cache_hits"] == 1
+    assert log.stats["cache_misses"] == 1
+
+
+def test_logger_promote(tmp_path):
+    """ The best working directory is moved to best_dir and the other
+        directories are deleted.
+    """
+    import os
+    best_dir = str(tmp_path / "Best")
+    records = []
+    for n, fi in enumerate([3.0, 1.0, 2.0, 0.5, 4.0]):
+        pwd = tmp_path / ("Work_%d" % n)
+        pwd.mkdir()
+        (pwd / "output.csv").write_text(str(fi))
+        records.append((fi, [fi], str(pwd), {}, None))
+    with Logger(params=[("x", (0, 10))],
+                logfile=str(tmp_path / "log.csv"),
+                best_dir=best_dir) as log:
+        log.add((records[:3], time.time()))
+        log()
+        assert (tmp_path / "Best" / "output.csv").read_text() == "1.0"
+        log.add((records[3:], time.time()))
+        log()
+    assert (tmp_path / "Best" / "output.csv").read_text() == "0.5"
+    assert sorted(os.listdir(str(tmp_path))) == ["Best", "evals_log.csv",
+                                                 "log.csv"]
+
+
+def test_logger_promote_missing(tmp_path):
+    """ A best point evaluated on another node, whose working directory is
+        not found, leaves best_dir as it is
+    """
+    best_dir = tmp_path / "Best"
+    pwd = tmp_path / "Work_0"
+    pwd.mkdir()
+    (pwd / "output.csv").write_text("1.0")
+    records = [(1.0, [1.0], str(pwd), {}, None),
+               (0.5, [0.5], str(tmp_path / "remote" / "Work_1"), {}, None)]
+    with Logger(params=[("x", (0, 10))],
+                logfile=str(tmp_path / "log.csv"),
+                best_dir=str(best_dir)) as log:
+        log.add((records, time.time()))
+        log()
+    assert log.f_best == 0.5
+    assert (best_dir / "output.csv").read_text() == "1.0"
+
+
+def test_logger_archive(tmp_path):
+    """ Results with data are archived, terminated runs are not """
+    from pyropython.archive import Archive
+    data = {"HRR": (np.array([0.0, 1.0]), np.array([2.0, 3.0]))}
+    records = [(1.0, [0.1], None, {}, data),
+               (2.0, [0.2], None, {"early_terminations": 1}, data),
+               (3.0, [0.3], None, {}, None)]
+    archive_dir = str(tmp_path / "Archive")
+    with Logger(params=[("x", (0, 1))],
+                logfile=str(tmp_path / "log.csv"),
+                best_dir=str(tmp_path / "Best"),
+                archive_dir=archive_dir) as log:
+        log.add((records, time.time()))
+    archive = Archive(archive_dir)
+    assert len(archive) == 1
+    f, x, arch_data = next(iter(archive))
+    assert f == 1.0
+    assert np.allclose(x, [0.1])
+    assert np.allclose(arch_data["HRR"][1], [2.0, 3.0])
+
+
+def test_logger_archive_flush(tmp_path):
+    """ The archive is written after each iteration when the flush interval
+        has passed, without closing the logger
+    """
+    from pyropython.archive import Archive
+    data = {"HRR": (np.array([0.0, 1.0]), np.array([2.0, 3.0]))}
+    archive_dir = str(tmp_path / "Archive")
+    log = Logger(params=[("x", (0, 1))],
+                 logfile=str(tmp_path / "log.csv"),
+                 best_dir=str(tmp_path / "Best"),
+                 archive_dir=archive_dir,
+                 archive_flush_interval=0.0)
+    log.add(([(1.0, [0.1], None, {}, data)], time.time()))
+    log()
+    assert len(Archive(archive_dir)) == 1
+
+
+def test_logger_evals(tmp_path):
+    """ Evaluations are written to the evaluation log with their wall time,
+        points that were not evaluated are not.
+    """
+    records = [(1.0, [0.1], None, {"wall_time": 2.5}, None),
+               (2.0, [0.2], None, {}, None),
+               (3.0, [0.3], None, {"wall_time": 1.25}, None)]
+    with Logger(params=[("x", (0, 1))],
+                logfile=str(tmp_path / "case.csv"),
+                best_dir=str(tmp_path / "Best")) as log:
+        log.add((records, time.time()))
+    lines = (tmp_path / "evals_case.csv").read_text().splitlines()
+    assert lines[0] == "Evaluation,x,Objective,Wall time"
+    assert [line.split(",") for line in lines[1:]] == \
+        [["1", "0.1", "1.000000e+00", "2.500"],
+         ["2", "0.3", "3.000000e+00", "1.250"]]
+    assert log.stats["wall_time"] == 3.75
+
+
+def test_map_longest_first(tmp_path):
+    """ The slowest points are submitted first, the results are returned in
+        the order of the points
+    """
+    log = Logger(params=[("x", (0, 10))],
+                 logfile=str(tmp_path / "log.csv"))
+    for n in range(10):
+        log.queue.put((n, [n], None, {"runtime:a.fds": 1.0 + n}, None))
+    log()
+    submitted = []
+
+    def fun(x):
+        submitted.append(x)
+        return x[0]
+    with ThreadPoolExecutor(1) as ex:
+        results = list(map_longest_first(ex, fun, [[1], [8], [4]], log))
+    assert results == [1, 8, 4]
+    assert submitted == [[8], [4], [1]]
+
+
+def test_logger_runtimes(tmp_path):
+    """ The median runtimes are written for the evaluations, a stale file is
+        removed. Evaluations with timeouts are not archived.
+    """
+    import json
+    from pyropython.archive import Archive
+    data = {"HRR": (np.array([0.0, 1.0]), np.array([2.0, 3.0]))}
+    runtime_file = tmp_path / "runtimes.json"
+    runtime_file.write_text("{}")
+    records = [(1.0, [0.1], None, {"runtime:a.fds": 1.0}, data),
+               (2.0, [0.2], None, {"runtime:a.fds": 4.0}, data),
+               (100.0, [0.3], None, {"timeouts": 1}, data)]
+    with Logger(params=[("x", (0, 1))],
+                logfile=str(tmp_path / "log.csv"),
+                best_dir=str(tmp_path / "Best"),
+                runtime_file=str(runtime_file),
+                archive_dir=str(tmp_path / "Archive")) as log:
+        assert not runtime_file.exists()
+        log.add((records, time.time()))
+    medians = json.loads(runtime_file.read_text())
+    assert list(medians) == ["a.fds"]
+    assert np.isclose(medians["a.fds"][0], 2.0)
+    assert medians["a.fds"][1] == 2
+    assert log.stats["timeouts"] == 1
+    assert len(Archive(str(tmp_path / "Archive"))) == 2
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from pyropython.reduction import reduction_types, get_reduction
+
+
+def make_data(n=3000):
+    x = np.linspace(0, 1800, n)
+    y = 50 - 50*np.tanh((x - 600)/50)
+    w = np.linspace(1, 2, n)
+    return x, y, w
+
+
+def test_reductions():
+    """ All reductions keep the shape of the data and the weights """
+    x, y, w = make_data()
+    for name, reduce in reduction_types.items():
+        xr, yr, wr = reduce(x, y, w, num_points=100)
+        if name != "none":
+            assert len(xr) <= 102
+        assert len(xr) == len(yr) == len(wr)
+        assert np.all(np.diff(xr) > 0)
+        assert np.allclose(yr, np.interp(xr, x, y), atol=1.0)
+        assert np.allclose(wr, np.interp(xr, x, w), atol=0.01)
+        # short series are not changed
+        assert len(reduce(x[:50], y[:50], w[:50], num_points=100)[0]) == 50
+
+
+def test_bin_reduction():
+    x, y, w = make_data(1000)
+    xr, yr, wr = get_reduction("bin")(x, y, w, num_points=10)
+    assert np.isclose(xr[0], x[:100].mean())
+    assert np.isclose(yr[-1], y[-100:].mean())
+    assert np.isclose(wr.mean(), w.mean())
+
+
+def test_adaptive_reduction():
+    """ Points are concentrated near the step """
+    x, y, w = make_data()
+    xr, yr, wr = get_reduction("adaptive")(x, y, w, num_points=100)
+    assert xr[0] == x[0] and xr[-1] == x[-1]
+    near = np.sum(np.abs(xr - 600) < 150)
+    assert near > 100*300/1800
+
+
+def test_read_model_reduction(tmp_path, monkeypatch):
+    """ The experimental data is reduced, and the parsed config can be read
+        again, e.g. for the plots
+    """
+    import sys
+    from pyropython.config import read_model, read_plots
+    monkeypatch.chdir(tmp_path)
+    x, y, w = make_data(1000)
+    (tmp_path / "exp.csv").write_text(
+        "Time,Y\n" + "".join("%g,%g\n" % (xi, yi) for xi, yi in zip(x, y)))
+    (tmp_path / "model.txt").write_text("a={{a}}")
+    reduction = {"type": "bin", "num_points": 10}
+    cfg = {"variables": {"a": [0, 1]},
+           "templates": ["model.txt"],
+           "fds_command": sys.executable,
+           "simulation": {"Y": {"fname": "out.csv", "dep_col_name": "Y"}},
+           "experiment": {"Y": {"fname": "exp.csv", "dep_col_name": "Y",
+                                "reduction": reduction}}}
+    for n in range(2):
+        case = read_model(cfg)
+        assert len(case.exp_data["Y"][0]) <= 12
+    assert cfg["experiment"]["Y"]["reduction"] == {"type": "bin",
+                                                   "num_points": 10}
+    plots = read_plots(cfg)
+    assert len(plots.exp_data["Y"][0]) == 1000
+    assert "reduction" in cfg["experiment"]["Y"]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pytest
+from pyropython import workers
+from pyropython.remote import socket_pool, parse_address
+from pyropython.tests.test_model import make_linear_case
+
+
+def test_parse_address():
+    assert parse_address("node1:6000") == ("node1", 6000)
+    assert parse_address(("", 0)) == ("", 0)
+
+
+def test_socket_pool(tmp_path, monkeypatch):
+    """ Evaluations in socket workers should match direct evaluation """
+    monkeypatch.chdir(tmp_path)
+    case = make_linear_case(str(tmp_path))
+    x = [[2, 1], [1, 0.5], [3, 2], [2.5, 1]]
+    expected = [case.fitness(xi) for xi in x]
+    with socket_pool(case, 2, authkey="test") as ex:
+        results = list(ex.map(workers.fitness, x))
+        # exceptions are raised in the driver
+        with pytest.raises(ValueError):
+            ex.submit(workers.fitness, [1, 2, 3]).result()
+    for (records, sent), xi, fi in zip(results, x, expected):
+        f, x_, pwd, stats, data = records[0]
+        assert np.isclose(f, fi)
+        assert np.allclose(x_, xi)
+        assert os.path.isdir(pwd)
+
+
+def crash_once(flag):
+    """ Kills the worker on the first call """
+    if not os.path.exists(flag):
+        open(flag, "w").close()
+        os._exit(1)
+    return "done"
+
+
+def test_lost_worker(tmp_path):
+    """ The task of a lost worker is run by another worker """
+    case = make_linear_case(str(tmp_path))
+    flag = str(tmp_path / "flag")
+    with socket_pool(case, 2, authkey="test") as ex:
+        assert ex.submit(crash_once, flag).result(timeout=60) == "done"
+
+
+def crash(flag):
+    """ Kills the worker on every call """
+    os._exit(1)
+
+
+def test_resubmit_limit(tmp_path):
+    """ A task killing its workers fails after max_resubmits resubmits """
+    case = make_linear_case(str(tmp_path))
+    with socket_pool(case, 3, authkey="test", max_resubmits=1) as ex:
+        with pytest.raises(RuntimeError):
+            ex.submit(crash, None).result(timeout=60)
+        # the remaining worker runs the next task
+        (tmp_path / "flag").write_text("")
+        assert ex.submit(crash_once, str(tmp_path / "flag")).result(
+            timeout=60) == "done"
+
+
+def test_authkey(tmp_path, monkeypatch, capsys):
+    """ Workers on other nodes need a key given by the user, which is never
+        printed
+    """
+    monkeypatch.delenv("PYROPYTHON_AUTHKEY", raising=False)
+    case = make_linear_case(str(tmp_path))
+    with pytest.raises(ValueError):
+        with socket_pool(case, 1, address="0.0.0.0:0"):
+            pass
+    monkeypatch.setenv("PYROPYTHON_AUTHKEY", "secret-key")
+    with socket_pool(case, 1, address="127.0.0.1:0", local_workers=0):
+        pass
+    out = capsys.readouterr().out
+    assert "pyropython worker" in out
+    assert "secret-key" not in out
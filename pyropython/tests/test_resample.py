@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from pyropython.resample import Resampler, interp_weights
+
+
+def test_interp_weights():
+    """ Interpolation with the weights should match np.interp """
+    xp = np.array([0.0, 1.0, 1.0, 2.5, 4.0])
+    fp = np.array([1.0, 2.0, 3.0, -1.0, 0.5])
+    x = np.linspace(-1, 5, 61)
+    i0, i1, w = interp_weights(x, xp)
+    f = fp[i0] + w*(fp[i1] - fp[i0])
+    # np.interp is not unique at the repeated point
+    mask = x != 1.0
+    assert np.allclose(f[mask], np.interp(x, xp, fp)[mask])
+
+
+def test_resampler():
+    """ Weights are reused until the simulation times change """
+    etime = np.linspace(0, 10, 21)
+    exp_data = {"A": (etime, etime), "B": (etime[::2], etime[::2])}
+    resample = Resampler()
+    T = np.linspace(0, 12, 13)
+    for n in range(3):
+        data = {"A": (T, n*T**2), "B": (T, np.sin(n*T))}
+        res = resample(exp_data, data)
+        assert np.allclose(res["A"], np.interp(etime, T, n*T**2))
+        assert np.allclose(res["B"], np.interp(etime[::2], T, np.sin(n*T)))
+    assert resample.num_updates == 1
+    T = np.linspace(0, 12, 25)
+    res = resample(exp_data, {"A": (T, T**2)})
+    assert np.allclose(res["A"], np.interp(etime, T, T**2))
+    assert sorted(res) == ["A"]
+    assert resample.num_updates == 2
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from pyropython.archive import Archive
+from pyropython.rescore import rescore, write_ranked
+from pyropython.utils import read_initial_design
+from pyropython.tests.test_model import make_linear_case
+
+
+def test_rescore(tmp_path):
+    """ Re-scoring gives the same values as Model.objective() """
+    case = make_linear_case(str(tmp_path))
+    archive = Archive(str(tmp_path / "Archive"),
+                      params=[("b", [0, 2]), ("a", [0, 4])], chunk_size=7)
+    rng = np.random.RandomState(0)
+    expected = []
+    for n in range(20):
+        a, b = rng.uniform(0, 4), rng.uniform(0, 2)
+        # simulations with different output intervals
+        T = np.linspace(0, 100, 51 + n)
+        data = {"Y": (T, a*T + b)}
+        archive.append(0.0, [b, a], data)
+        expected.append(case.objective(data))
+    archive.flush()
+    X, f = rescore(case, archive)
+    assert X.shape == (20, 2)
+    assert np.allclose(f, expected, rtol=1e-5)
+    # the ranked file can be used as an initial design
+    fname = str(tmp_path / "rescored.csv")
+    write_ranked(fname, case.params, X, f, num_best=5)
+    Xi, yi = read_initial_design(fname, ["a", "b"])
+    assert len(Xi) == 5
+    assert np.allclose(yi, np.sort(f)[:5])
+    assert np.allclose(Xi[0], X[np.argmin(f)])
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import numpy as np
+from pyropython.runner import Simulation, run_simulations
+
+
+def make_simulations(path, num=3, script="import time\ntime.sleep(0.5)\n"):
+    sims = []
+    for n in range(num):
+        fname = "sim%d.py" % n
+        with open(os.path.join(path, fname), "w") as f:
+            f.write(script)
+        sims.append(Simulation(sys.executable, fname, path))
+    return sims
+
+
+def test_run_serial(tmp_path):
+    sims = make_simulations(str(tmp_path))
+    assert run_simulations(sims, max_parallel=1)
+    assert [sim.returncode for sim in sims] == [0, 0, 0]
+    for prev, sim in zip(sims[:-1], sims[1:]):
+        assert sim.start_time >= prev.end_time
+    assert os.path.exists(str(tmp_path / "sim0.py_stdout.txt"))
+
+
+def test_run_parallel(tmp_path):
+    sims = make_simulations(str(tmp_path))
+    assert run_simulations(sims, max_parallel=3)
+    assert [sim.returncode for sim in sims] == [0, 0, 0]
+    assert max(sim.start_time for sim in sims) < min(sim.end_time
+                                                     for sim in sims)
+
+
+def test_monitor(tmp_path):
+    """ Monitor returning True should kill running simulations and prevent
+        the pending ones from starting.
+    """
+    sims = make_simulations(str(tmp_path), script="import time\ntime.sleep(30)\n")
+    calls = []
+
+    def monitor():
+        calls.append(1)
+        return len(calls) > 1
+
+    completed = run_simulations(sims, max_parallel=2,
+                                monitor=monitor, monitor_interval=0.1)
+    assert not completed
+    assert len(calls) == 2
+    assert sims[0].returncode is not None and sims[0].returncode != 0
+    assert sims[0].runtime < 10
+    assert sims[2].proc is None
+
+
+def test_timeout(tmp_path):
+    """ Simulations running longer than their timeout are killed, the
+        others run to the end
+    """
+    sims = make_simulations(str(tmp_path), num=2,
+                            script="import time\ntime.sleep(30)\n")
+    sims[1] = make_simulations(str(tmp_path), num=1)[0]
+    sims[0].timeout = 0.2
+    sims[1].timeout = 10.0
+    assert run_simulations(sims, max_parallel=2)
+    assert sims[0].timed_out
+    assert sims[0].returncode != 0
+    assert sims[0].runtime < 10
+    assert not sims[1].timed_out
+    assert sims[1].returncode == 0
+
+
+def test_core_slots(tmp_path):
+    """ Simulations should not use more cores than available, and smaller
+        simulations should fill the free cores without delaying the larger
+        ones
+    """
+    from pyropython.scheduler import CoreSlots
+    sims = make_simulations(str(tmp_path), num=4)
+    for sim, cores in zip(sims, [2, 3, 1, 2]):
+        sim.cores = cores
+    # 2 is expected to finish before 1 can start
+    sims[2].expected_runtime = 0.01
+    slots = CoreSlots(4, nodes=[[0, 1, 2, 3]])
+    assert run_simulations(sims, max_parallel=None, slots=slots)
+    assert slots.free == 4
+    # 0 and 2 run first, 1 waits for 0, and 3 for 1
+    assert sims[2].start_time < sims[0].end_time
+    assert sims[1].start_time >= sims[0].end_time
+    assert sims[3].start_time >= sims[1].end_time
+    for sim in sims:
+        assert sum(other.cores for other in sims
+                   if other.start_time <= sim.start_time < other.end_time) <= 4
+    # too large requests use the whole node, no request is left queued
+    assert slots.try_acquire(8) == [0, 1, 2, 3]
+    assert slots.try_acquire(1) == []
+    slots.release([0, 1, 2, 3])
+
+
+def test_no_starvation(tmp_path):
+    """ A large simulation is not held back by a stream of small ones of
+        another evaluation
+    """
+    import threading
+    from pyropython.scheduler import CoreSlots
+    slots = CoreSlots(2, nodes=[[0, 1]])
+    # staggered, so that the two cores are never free at the same time
+    small = []
+    for n in range(6):
+        fname = "small%d.py" % n
+        (tmp_path / fname).write_text("import time\ntime.sleep(%.2f)\n" %
+                                      (0.3 + 0.45*(n % 2)))
+        small.append(Simulation(sys.executable, fname, str(tmp_path)))
+    large = make_simulations(str(tmp_path), num=1)[0]
+    large.cores = 2
+    thread = threading.Thread(target=run_simulations, args=(small,),
+                              kwargs={"max_parallel": 2, "slots": slots})
+    thread.start()
+    while small[0].start_time is None:
+        time.sleep(0.01)
+    assert run_simulations([large], slots=slots)
+    thread.join()
+    assert all(sim.returncode == 0 for sim in small)
+    assert large.start_time < max(sim.start_time for sim in small)
+
+
+def test_backfill():
+    """ The oldest queued request gets the next free cores, others are
+        served first only if they finish before it can start
+    """
+    from pyropython.scheduler import CoreSlots
+    slots = CoreSlots(4, nodes=[[0, 1, 2, 3]])
+    first = slots.try_acquire(2, runtime=10.0)
+    second = slots.try_acquire(1, runtime=100.0)
+    ticket = slots.enqueue(4)
+    assert slots.try_acquire(4, ticket=ticket) == []
+    # unknown or too long runtime, or not enough cores for both
+    assert slots.try_acquire(1) == []
+    assert slots.try_acquire(1, runtime=200.0) == []
+    later = slots.enqueue(1)
+    assert slots.try_acquire(1, ticket=later) == []
+    # finishes before the first request releases its cores
+    assert len(slots.try_acquire(1, runtime=5.0)) == 1
+    slots.release(first)
+    assert slots.try_acquire(2, ticket=later) == []
+    slots.release(second)
+    slots.release([3])
+    assert slots.try_acquire(1, ticket=later) == []
+    assert slots.try_acquire(4, ticket=ticket) == [0, 1, 2, 3]
+    slots.release([0, 1, 2, 3])
+    assert slots.try_acquire(1, ticket=later) == [0]
+    slots.release([0])
+    # cancelled requests have no priority
+    ticket = slots.enqueue(4)
+    slots.try_acquire(1)
+    slots.cancel(ticket)
+    assert len(slots.try_acquire(1)) == 1
+
+
+def test_launch_args():
+    from pyropython.scheduler import Resources
+    res = Resources(ranks=4, threads=2)
+    assert res.cores == 8
+    assert res.launch_args("mpiexec -n {ranks} {command} {fname}",
+                           "/opt/fds/fds", "cone 50.fds") == \
+        ["mpiexec", "-n", "4", "/opt/fds/fds", "cone 50.fds"]
+    assert Resources().launch_args("{command} {fname}", "fds", "a.fds") == \
+        ["fds", "a.fds"]
+
+
+def test_numa_slots(tmp_path):
+    """ The cores should be spread across the NUMA nodes, but the cores of a
+        simulation taken from one node if possible
+    """
+    from pyropython.scheduler import CoreSlots, parse_cpulist
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    slots = CoreSlots(nodes=[[0, 1, 2, 3], [4, 5, 6, 7]])
+    assert slots.try_acquire(2) == [0, 1]
+    assert slots.try_acquire(2) == [4, 5]
+    assert slots.try_acquire(1) == [2]
+    # node 1 has more free cores
+    assert slots.try_acquire(1) == [6]
+    assert slots.try_acquire(3) == []
+    slots.release([0, 1])
+    assert slots.try_acquire(3) == [0, 1, 3]
+    slots.release([3])
+    # no node has two free cores
+    assert slots.try_acquire(2) == [3, 7]
+    assert slots.free == 0
+    # four cores of eight, from both nodes
+    assert CoreSlots(4, nodes=[[0, 1, 2, 3], [4, 5, 6, 7]]).cores == \
+        [0, 1, 4, 5]
+
+
+def test_pinning(tmp_path):
+    """ Pinned simulations should run on their cores only """
+    from pyropython.scheduler import CoreSlots
+    script = "import os\nprint(sorted(os.sched_getaffinity(0)))\n"
+    sims = make_simulations(str(tmp_path), num=2, script=script)
+    affinity = os.sched_getaffinity(0)
+    slots = CoreSlots(1, pin=True)
+    assert run_simulations(sims, max_parallel=None, slots=slots)
+    for sim in sims:
+        assert sim.affinity == slots.cores
+        with open(str(tmp_path / ("%s_stdout.txt" % sim.fname))) as f:
+            assert f.read().strip() == str(slots.cores)
+    # the affinity of this process is not changed
+    assert os.sched_getaffinity(0) == affinity
+
+
+def test_runtime_model():
+    """ The runtime model should learn which points are slow """
+    from pyropython.scheduler import RuntimeModel
+    model = RuntimeModel([(0, 10), (0, 1)])
+    x = [[1, 0.5], [9, 0.5], [5, 0.5]]
+    # without data, the order is kept
+    assert model.order(x) == [0, 1, 2]
+    rng = np.random.RandomState(0)
+    for xi in rng.uniform([0, 0], [10, 1], size=(20, 2)):
+        model.add(xi, {"a.fds": 2.0**xi[0], "b.fds": 1.0})
+    assert len(model) == 20
+    assert model.order(x) == [1, 2, 0]
+    assert np.allclose(model.predict([[4, 0.2]]), [17.0], rtol=0.1)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+from pyropython.sandbox import SandboxPool
+
+
+def test_reuse(tmp_path):
+    """ Released sandboxes are wiped and reused, static files are kept """
+    static = tmp_path / "static.txt"
+    static.write_text("static")
+    pool = SandboxPool(str(tmp_path / "Work"), static_files=[str(static)])
+    pwd = pool.acquire()
+    assert os.path.isfile(os.path.join(pwd, "static.txt"))
+    with open(os.path.join(pwd, "out.csv"), "w") as f:
+        f.write("1,2\n")
+    os.mkdir(os.path.join(pwd, "sub"))
+    pool.release(pwd)
+    assert pool.acquire() == pwd
+    assert os.listdir(pwd) == ["static.txt"]
+    with open(os.path.join(pwd, "static.txt")) as f:
+        assert f.read() == "static"
+    # detached sandboxes are left to the caller
+    pool.detach(pwd)
+    other = pool.acquire()
+    assert other != pwd
+    pool.release(other)
+    pool.clear()
+    assert not os.path.exists(other)
+    assert os.path.exists(pwd)
+
+
+def test_pickle(tmp_path):
+    """ Copies of the pool, e.g. in worker processes, start empty """
+    pool = SandboxPool(str(tmp_path))
+    pwd = pool.acquire()
+    pool.release(pwd)
+    copy = pickle.loads(pickle.dumps(pool))
+    assert copy.root == pool.root
+    assert copy.acquire() != pwd
@@ -59,3 +59,61 @@ def test_read_data():
     assert np.allclose(read_Time, read_AltTime)
     # rtol = 1e-5 fails
     assert np.allclose(dy, calc_dy, rtol=1e-4)
+
+
+def test_move_dir(tmp_path):
+    from pyropython.utils import move_dir
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("a")
+    assert move_dir(str(src), str(tmp_path / "dst"))
+    assert not src.exists()
+    assert (tmp_path / "dst" / "a.txt").read_text() == "a"
+
+
+def test_background_deleter(tmp_path):
+    from pyropython.utils import BackgroundDeleter
+    deleter = BackgroundDeleter(max_backlog=2)
+    dirs = []
+    for n in range(5):
+        d = tmp_path / ("dir%d" % n)
+        d.mkdir()
+        (d / "file").write_text("x")
+        dirs.append(d)
+        deleter.remove(str(d))
+    deleter.close()
+    assert not any(d.exists() for d in dirs)
+
+
+def test_read_fds_csv(tmp_path):
+    """ The fast reader should agree with pandas and ignore a partially
+        written last line of a running simulation.
+    """
+    from pyropython.utils import read_fds_csv, _read_columns_pandas
+    import pytest
+    Time = np.linspace(0, 10, 11)
+    lines = ['"s","kW","C"', '"Time","HRR","TC (1)"']
+    lines += ["%.7E,%.7E,%.7E" % (t, 2*t, 3*t) for t in Time]
+    fname = tmp_path / "devc.csv"
+    fname.write_text("\n".join(lines) + "\n")
+    table = read_fds_csv(str(fname), columns=["Time", "TC"])
+    ref = _read_columns_pandas(str(fname), columns=["Time", "TC"])
+    assert sorted(table) == ["TC", "Time"]
+    assert np.allclose(table["Time"], ref["Time"])
+    assert np.allclose(table["TC"], ref["TC"])
+    with pytest.raises(KeyError):
+        read_fds_csv(str(fname), columns=["Time", "MLR"])
+    # partial last line of a running simulation
+    fname.write_text("\n".join(lines) + "\n1.1000000E+01,2.2")
+    table = read_fds_csv(str(fname), columns=["Time", "HRR"], partial=True)
+    assert np.allclose(table["Time"], Time)
+    # a complete file without a trailing newline keeps its last line
+    fname.write_text("\n".join(lines))
+    table = read_fds_csv(str(fname), columns=["Time", "HRR"])
+    assert np.allclose(table["Time"], Time)
+    ref = _read_columns_pandas(str(fname), columns=["Time", "HRR"])
+    assert np.allclose(table["HRR"], ref["HRR"])
+    # non-numeric data is left to the general reader
+    fname.write_text("\n".join(lines[:5] + ["1.0,a,2.0"] + lines[5:]) + "\n")
+    with pytest.raises(ValueError):
+        read_fds_csv(str(fname), columns=["Time", "HRR"])
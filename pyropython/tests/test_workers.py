@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from pyropython import workers
+from pyropython.tests.test_model import make_linear_case
+
+
+def test_share_arrays():
+    arrays = {"a": np.linspace(0, 1, 11),
+              ("b", 1): np.arange(5),
+              "c": np.ones((3, 2), dtype=np.float32)}
+    shm, layout = workers.share_arrays(arrays)
+    try:
+        shm2, shared = workers.attach_arrays(shm.name, layout)
+        for key, arr in arrays.items():
+            assert shared[key].dtype == arr.dtype
+            assert np.array_equal(shared[key], arr)
+            assert not shared[key].flags.writeable
+        del shared
+        shm2.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_worker_pool(tmp_path, monkeypatch):
+    """ Evaluations in the worker pool should match direct evaluation """
+    monkeypatch.chdir(tmp_path)
+    case = make_linear_case(str(tmp_path))
+    x = [[2, 1], [1, 0.5], [3, 2]]
+    expected = [case.fitness(xi) for xi in x]
+    with workers.worker_pool(case, 2) as ex:
+        results = list(ex.map(workers.fitness, x))
+    for (records, sent), xi, fi in zip(results, x, expected):
+        assert len(records) == 1
+        f, x_, pwd, stats, data = records[0]
+        assert np.isclose(f, fi)
+        assert np.allclose(x_, xi)
+        assert os.path.isdir(pwd)
+    # the original model is not modified
+    assert "Y" in case.exp_data
+
+
+def test_thread_pool(tmp_path, monkeypatch):
+    """ Concurrent evaluations in threads should match direct evaluation
+        without changing the working directory of the process
+    """
+    monkeypatch.chdir(tmp_path)
+    case = make_linear_case(str(tmp_path))
+    x = [[2, 1], [1, 0.5], [3, 2], [2.5, 1], [0.5, 0], [2, 1.5]]
+    expected = [case.fitness(xi) for xi in x]
+
+    def chdir(path):
+        raise AssertionError("os.chdir called")
+    monkeypatch.setattr(os, "chdir", chdir)
+    with workers.get_executor("thread")(case, 4) as ex:
+        results = list(ex.map(workers.fitness, x))
+    assert workers._case is None
+    for (records, sent), xi, fi in zip(results, x, expected):
+        f, x_, pwd, stats, data = records[0]
+        assert np.isclose(f, fi)
+        assert np.allclose(x_, xi)
+    assert os.getcwd() == str(tmp_path)
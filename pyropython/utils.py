@@ -1,6 +1,10 @@
 import os
+import io
+import shutil
+import warnings
+import threading
+from queue import Queue
 from pyropython.filter import get_filter
-from pandas import read_csv
 from numpy import array,genfromtxt
 from numpy import gradient as np_gradient
 import numpy as np
@@ -14,6 +18,59 @@ def ensure_dir(f):
     except FileExistsError:
           pass 
 
+
+def move_dir(src, dst):
+    """ Moves directory src to dst, which must not exist.
+
+    The directory is renamed if possible. Across file systems, the files
+    are hard linked, or copied if that fails too. In that case src is left
+    in place and the caller is responsible for deleting it.
+
+    Returns:
+        moved (:boolean): True if src was renamed
+    """
+    try:
+        os.rename(src, dst)
+        return True
+    except OSError:
+        pass
+    try:
+        shutil.copytree(src, dst, copy_function=os.link)
+    except OSError:
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst)
+    return False
+
+
+class BackgroundDeleter:
+    """ Deletes directories in a background thread.
+
+    At most max_backlog directories can wait for deletion, after which
+    remove() blocks until the thread has caught up.
+    """
+
+    def __init__(self, max_backlog=100):
+        self.queue = Queue(max_backlog)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+
+    def remove(self, path):
+        """ Schedule directory path for deletion """
+        self.queue.put(path)
+
+    def close(self):
+        """ Wait until all scheduled directories have been deleted """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
 def read_initial_design(filename,param_names):
     """Read initial design from a csv file.
     
@@ -42,6 +99,176 @@ def read_initial_design(filename,param_names):
     return Xi.tolist(),list(yi)
     
 
+def _colname(name):
+    """ Column name without trailing units """
+    return name.split('(')[0].strip()
+
+
+def _missing_columns(missing, fname, names):
+    msg = ("Column named '%s' in file '%s' not found." % (missing[0], fname) +
+           "Column names: \n %s" % (','.join(names)))
+    return KeyError(msg)
+
+
+def read_fds_csv(path, columns=None, header=1, partial=False):
+    """
+    Fast reader for numeric csv files in the FDS layout: header lines
+    (e.g. units), a line of column names and rows of numbers. Only the
+    requested columns are parsed.
+
+    Args:
+        path (:string): Filename
+        columns (:list): Names of the columns to read. If None, all columns
+          are read.
+        header (:int): How many header lines before the line containing the
+          column names.
+        partial (:bool): If True, the file is being written by a running
+          simulation and a last line without a newline is ignored.
+    Returns:
+        table (:dict): Dictionary, with entries column name: values
+    Raises:
+        ValueError: if the file does not have the expected layout. Use
+          read_columns(), which falls back to a general csv reader.
+    """
+    with open(path, "rb") as f:
+        for n in range(header):
+            f.readline()
+        names = [_colname(name.decode("latin-1").strip().strip('"'))
+                 for name in f.readline().split(b",")]
+        if columns is None:
+            columns = names
+        missing = [name for name in columns if name not in names]
+        if missing:
+            raise _missing_columns(missing, path, names)
+        usecols = [names.index(name) for name in columns]
+        complete = True
+        if partial:
+            start = f.tell()
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(end - 1, start))
+            complete = f.read(1) in (b"\n", b"")
+            f.seek(start)
+        if complete:
+            src = f
+        else:
+            # drop the partially written last line
+            body = f.read()
+            src = io.BytesIO(body[:body.rfind(b"\n") + 1])
+        with warnings.catch_warnings():
+            # empty files are not an error
+            warnings.simplefilter("ignore", UserWarning)
+            values = np.loadtxt(src,
+                                delimiter=",",
+                                comments="#",
+                                usecols=usecols,
+                                ndmin=2,
+                                dtype=float)
+    if values.size == 0:
+        values = np.zeros((0, len(columns)))
+    table = {}
+    for n, name in enumerate(columns):
+        # like the general reader, columns with missing values are dropped
+        if name not in table and not np.isnan(values[:, n]).any():
+            table[name] = values[:, n]
+    missing = [name for name in columns if name not in table]
+    if missing:
+        raise _missing_columns(missing, path, names)
+    return table
+
+
+def read_columns(fname, columns=None, header=1, cwd="./", partial=False):
+    """
+    Reads columns from a csv datafile.
+
+    Numeric files in the FDS layout are read with read_fds_csv(). Other
+    files are read with pandas.
+
+    Args:
+        fname (:string): Filename
+        columns (:list): Names of the columns to read. If None, all columns
+          are read.
+        header (:int): How many header lines before the line containing the
+          column names.
+        cwd (:string): Working directory (default "./")
+        partial (:bool): If True, the file is being written by a running
+          simulation, see read_fds_csv().
+    Returns:
+        table (:dict): Dictionary, with entries column name: values
+    """
+    path = os.path.join(cwd, fname)
+    try:
+        return read_fds_csv(path, columns=columns, header=header,
+                            partial=partial)
+    except ValueError:
+        pass
+    return _read_columns_pandas(fname, columns=columns, header=header, cwd=cwd)
+
+
+def _read_columns_pandas(fname, columns=None, header=1, cwd="./"):
+    """ read_columns() using pandas.read_csv """
+    from pandas import read_csv
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        usecols = lambda name: _colname(name) in wanted
+    tmp = read_csv(os.path.join(cwd, fname),
+                   header=header,
+                   encoding="latin-1",
+                   index_col=False,
+                   comment="#",
+                   on_bad_lines="warn",
+                   skip_blank_lines=True,
+                   usecols=usecols,
+                   na_values="NaN")
+    # Remove trailing units from column headers
+    tmp.columns = [_colname(colname) for colname in tmp.columns]
+    tmp = tmp.dropna(axis=1, how='any')
+    table = {name: array(tmp[name]) for name in tmp.columns}
+    missing = [name for name in columns or [] if name not in table]
+    if missing:
+        if usecols is not None:
+            tmp = read_csv(os.path.join(cwd, fname),
+                           header=header,
+                           encoding="latin-1",
+                           index_col=False,
+                           nrows=0)
+        raise _missing_columns(missing, fname,
+                               [_colname(name) for name in tmp.columns.values])
+    return table
+
+
+def process_data(table,
+                 dep_col_name=None,
+                 ind_col_name=None,
+                 conversion_factor=1.0,
+                 normalize=False,
+                 filter_type="None",
+                 filter_opts={},
+                 gradient=False,
+                 **kwargs):
+    """
+    Extracts a data line from a table read by read_columns() and applies
+    filters and conversions. See read_data() for the arguments.
+
+    Returns:
+        x, y (:array): the independent and dependent variables
+    """
+    filter = get_filter(filter_type)
+    x = table[ind_col_name]
+    y = table[dep_col_name]
+    y = filter(x, y, **filter_opts)
+    if normalize:
+        y = y/y[0]  # assume TGA
+    if gradient:
+        y = -1.0*np_gradient(y)/np_gradient(x)
+    try:
+        y = y*conversion_factor
+    except TypeError:
+        y = np.array([np.float(s.strip()) for s in y])
+        print(y)
+    return x, y
+
+
 def read_data(fname=None,
               dep_col_name=None,
               ind_col_name=None,
@@ -76,38 +303,18 @@ def read_data(fname=None,
                 and F is the dependent variable
             pwd (:string): Working directory, where the simulation was run.
     """
-    tmp = read_csv(os.path.join(cwd, fname),
-                   header=header,
-                   encoding="latin-1",
-                   index_col=False,
-                   comment="#",
-                   error_bad_lines=False,
-                   warn_bad_lines=True,
-                   skip_blank_lines=True,
-                   na_values="NaN")
-    # Remove trailing units from column headers
-    tmp.columns = [colname.split('(')[0].strip() for colname in tmp.columns]
-    tmp = tmp.dropna(axis=1, how='any')
-    filter = get_filter(filter_type)
-    try:
-        x = array(tmp[ind_col_name])
-        y = array(tmp[dep_col_name])
-    except KeyError as KeyErr:
-        msg = ("Column named '%s' in file '%s' not found." % (KeyErr, fname) +
-               "Column names: \n %s" % (','.join(tmp.columns.values)))
-        raise KeyError(msg)
-
-    y = filter(x, y, **filter_opts)
-    if normalize:
-        y = y/y[0]  # assume TGA
-    if gradient:
-        y = -1.0*np_gradient(y)/np_gradient(x)
-    try:
-        y = y*conversion_factor
-    except TypeError:
-        y = np.array([np.float(s.strip()) for s in y])
-        print(y)
-    return x, y
+    table = read_columns(fname,
+                         columns=[ind_col_name, dep_col_name],
+                         header=header,
+                         cwd=cwd)
+    return process_data(table,
+                        dep_col_name=dep_col_name,
+                        ind_col_name=ind_col_name,
+                        conversion_factor=conversion_factor,
+                        normalize=normalize,
+                        filter_type=filter_type,
+                        filter_opts=filter_opts,
+                        gradient=gradient)
 
 
 def main():
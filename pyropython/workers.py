@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+pyropython.workers: Model evaluation in persistent worker processes
+
+The Model is sent to each worker process once, when the process is started.
+The experimental data, data weights and the arrays of the fused objective
+function are placed in shared memory, which the workers read without
+copying. Tasks sent to the workers carry only the parameter vector.
+
+The results are returned to the parent process as (records, sent), where
+records is a list of (fi, xi, pwd, stats, data) tuples, as put on the queue by
+Model.fitness(), and sent is the time.time() when the result was returned.
+See optimizer.Logger.add().
+
+Alternatively, the Model can be evaluated in threads of the main process
+(see thread_pool()). The simulator runs in a subprocess anyway, so one
+process can supervise many simulations without the memory of a Python
+worker process per simulation. Workers on other nodes are supported by
+pyropython.remote and, if mpi4py is installed, by mpi_pool().
+"""
+
+import copy
+import time
+from functools import partial
+from queue import SimpleQueue
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# Model used by the functions below. Set by init_worker() or thread_pool()
+_case = None
+_shm = None
+
+
+def share_arrays(arrays):
+    """ Copies arrays into a single block of shared memory
+
+    Args:
+        arrays (:dict): dictionary of numpy arrays
+
+    Returns:
+        shm (:SharedMemory): shared memory block. The caller is responsible
+            for calling close() and unlink().
+        layout (:dict): {key: (offset, shape, dtype)} for attach_arrays()
+    """
+    layout = {}
+    size = 0
+    for key, arr in arrays.items():
+        arr = np.asarray(arr)
+        # align all arrays to 8 bytes
+        offset = -(-size // 8) * 8
+        layout[key] = (offset, arr.shape, arr.dtype.str)
+        size = offset + arr.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, arr in arrays.items():
+        offset, shape, dtype = layout[key]
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        view[...] = arr
+    return shm, layout
+
+
+def attach_arrays(name, layout):
+    """ Attach to shared memory created by share_arrays()
+
+    Returns:
+        shm (:SharedMemory): shared memory block. Must be kept alive as long
+            as the arrays are used.
+        arrays (:dict): dictionary of read-only numpy arrays
+    """
+    try:
+        # don't let the resource tracker of the worker unlink the memory
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    arrays = {}
+    for key, (offset, shape, dtype) in layout.items():
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[key] = view
+    return shm, arrays
+
+
+def _model_arrays(case):
+    """ Collects the experimental data and weights of a Model """
+    arrays = {}
+    for key, (etime, edata) in case.exp_data.items():
+        arrays[("exp_data", key, 0)] = etime
+        arrays[("exp_data", key, 1)] = edata
+    for key, weights in case.data_weights.items():
+        arrays[("data_weights", key)] = weights
+    if case.fused_objective is not None:
+        for name in case.fused_objective.array_names:
+            arrays[("fused_objective", name)] = getattr(case.fused_objective,
+                                                        name)
+    return arrays
+
+
+def init_worker(case, shm_name, layout):
+    """ Initializer for the worker processes.
+
+    Args:
+        case (:Model): Model without exp_data, data_weights and the arrays
+            of fused_objective
+        shm_name (:string): name of the shared memory block
+        layout (:dict): layout of the arrays in shared memory
+    """
+    global _case, _shm
+    _shm, arrays = attach_arrays(shm_name, layout)
+    exp_data = {}
+    data_weights = {}
+    for name in layout:
+        if name[0] == "exp_data":
+            key = name[1]
+            exp_data[key] = (arrays[("exp_data", key, 0)],
+                             arrays[("exp_data", key, 1)])
+        elif name[0] == "data_weights":
+            data_weights[name[1]] = arrays[name]
+        else:
+            setattr(case.fused_objective, name[1], arrays[name])
+    case.exp_data = exp_data
+    case.data_weights = data_weights
+    _case = case
+
+
+def set_case(case):
+    """ Sets the Model evaluated by the functions in this module """
+    global _case
+    _case = case
+
+
+def _result(queue):
+    records = []
+    while not queue.empty():
+        records.append(queue.get())
+    return records, time.time()
+
+
+def fitness(x):
+    """ Model.fitness() of the Model of this worker """
+    queue = SimpleQueue()
+    _case.fitness(x, queue=queue)
+    return _result(queue)
+
+
+def penalized_fitness(x):
+    """ Model.penalized_fitness() of the Model of this worker """
+    queue = SimpleQueue()
+    _case.penalized_fitness(x, queue=queue)
+    return _result(queue)
+
+
+def minimize(x0, **kwargs):
+    """ Minimizes Model.penalized_fitness() of the Model of this worker
+        using scipy.optimize.minimize, starting from x0.
+
+        The keyword arguments are passed to scipy.optimize.minimize. All
+        evaluations made during the minimization are returned.
+    """
+    from scipy.optimize import minimize
+    queue = SimpleQueue()
+    minimize(partial(_case.penalized_fitness, queue=queue), x0, **kwargs)
+    return _result(queue)
+
+
+@contextmanager
+def worker_pool(case, num_jobs):
+    """ Starts a pool of worker processes for evaluating case.
+
+    The functions fitness() and penalized_fitness() in this module can be
+    submitted to the returned executor.
+
+    Args:
+        case (:Model): the model
+        num_jobs (:int): number of worker processes
+
+    Yields:
+        executor (:ProcessPoolExecutor)
+    """
+    shm, layout = share_arrays(_model_arrays(case))
+    stripped = copy.copy(case)
+    stripped.exp_data = None
+    stripped.data_weights = None
+    if case.fused_objective is not None:
+        stripped.fused_objective = copy.copy(case.fused_objective)
+        for name in case.fused_objective.array_names:
+            setattr(stripped.fused_objective, name, None)
+    try:
+        with ProcessPoolExecutor(num_jobs,
+                                 initializer=init_worker,
+                                 initargs=(stripped, shm.name, layout)) as ex:
+            yield ex
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+@contextmanager
+def thread_pool(case, num_jobs):
+    """ Starts a pool of threads for evaluating case in this process.
+
+    Same as worker_pool(), but the evaluations share case. This requires
+    that Model.fitness() does not modify process-wide state, such as the
+    working directory.
+
+    Args:
+        case (:Model): the model
+        num_jobs (:int): number of threads, i.e. concurrent evaluations
+
+    Yields:
+        executor (:ThreadPoolExecutor)
+    """
+    global _case
+    old_case, _case = _case, case
+    try:
+        with ThreadPoolExecutor(num_jobs) as ex:
+            yield ex
+    finally:
+        _case = old_case
+
+
+@contextmanager
+def mpi_pool(case, num_jobs, **kwargs):
+    """ Starts a pool of MPI worker processes for evaluating case, using
+        mpi4py.futures.MPIPoolExecutor.
+
+    The program must be started with MPI, e.g.
+    mpiexec -n 1 python -m mpi4py.futures -m pyropython config.yml, so that
+    the workers can be spawned on the nodes allocated for the job.
+
+    The cores of the nodes are not shared between the workers (see
+    Model.slots).
+
+    Args:
+        case (:Model): the model
+        num_jobs (:int): number of worker processes
+        kwargs: passed to MPIPoolExecutor
+
+    Yields:
+        executor (:MPIPoolExecutor)
+    """
+    try:
+        from mpi4py.futures import MPIPoolExecutor
+    except ImportError:
+        raise ImportError("The mpi executor requires mpi4py")
+    # the core slots cannot be sent to other nodes
+    case = copy.copy(case)
+    case.slots = None
+    with MPIPoolExecutor(num_jobs, initializer=set_case, initargs=(case,),
+                         **kwargs) as ex:
+        yield ex
+
+
+def socket_pool(case, num_jobs, **kwargs):
+    """ See pyropython.remote.socket_pool() """
+    from pyropython.remote import socket_pool
+    return socket_pool(case, num_jobs, **kwargs)
+
+
+# Context managers for starting an executor, called as
+# executor(case, num_jobs, **executor_opts)
+executors = {"process": worker_pool,
+             "thread": thread_pool,
+             "socket": socket_pool,
+             "mpi": mpi_pool}
+
+
+def get_executor(name="process"):
+    """ Returns the context manager for starting the executor name """
+    if name not in executors:
+        raise ValueError("Unknown executor %s. Choices are: %s" %
+                         (name, ", ".join(executors)))
+    return executors[name]